@@ -0,0 +1,193 @@
+'''
+Component profiler
+
+For more details about this component, please refer to the documentation at
+https://github.com/Sanderhuisman/home-assistant-custom-components
+'''
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+
+VERSION = '0.0.3'
+
+_LOGGER = logging.getLogger(__name__)
+
+DOMAIN = 'component_profiler'
+
+EVENT_SUMMARY = 'component_profiler_summary'
+
+SERVICE_DUMP = 'dump'
+SERVICE_RESET = 'reset'
+SERVICE_SAMPLING = 'sampling'
+
+ATTR_ENABLED = 'enabled'
+
+CONF_SAMPLING = 'sampling'
+CONF_SAMPLING_INTERVAL = 'sampling_interval'
+
+DEFAULT_SAMPLING_INTERVAL = 0.01
+
+# Number of functions in the summary of the sampling profiler
+SAMPLES_TOP = 20
+
+CONFIG_SCHEMA = vol.Schema({
+    DOMAIN: vol.Schema({
+        vol.Optional(CONF_SAMPLING, default=False):
+            cv.boolean,
+        vol.Optional(CONF_SAMPLING_INTERVAL, default=DEFAULT_SAMPLING_INTERVAL):
+            vol.All(vol.Coerce(float), vol.Range(min=0.001)),
+    })
+}, extra=vol.ALLOW_EXTRA)
+
+SERVICE_SAMPLING_SCHEMA = vol.Schema({
+    vol.Required(ATTR_ENABLED): cv.boolean,
+})
+
+# Calls, wall time, longest call and bytes per name, None while not set up
+_STATS = None
+_LOCK = threading.Lock()
+
+_SAMPLER = None
+
+
+def record(name, seconds, size=0):
+    """Record a call that took seconds and fetched size bytes."""
+    stats = _STATS
+    if stats is None:
+        return
+
+    with _LOCK:
+        entry = stats.get(name)
+        if entry is None:
+            entry = stats[name] = [0, 0.0, 0.0, 0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        entry[3] += size
+
+
+def summary():
+    """Return the recorded calls and the samples per function."""
+    with _LOCK:
+        stats = dict((name, list(entry)) for name, entry in (_STATS or {}).items())
+
+    calls = {}
+    for name, (count, total, longest, size) in sorted(stats.items()):
+        calls[name] = {
+            'calls': count,
+            'total': round(total, 3),
+            'mean': round(total / count, 6) if count else 0.0,
+            'max': round(longest, 6),
+            'bytes': size,
+        }
+
+    sampler = _SAMPLER
+    samples = sampler.most_common(SAMPLES_TOP) if sampler is not None else []
+
+    return {
+        'calls': calls,
+        'samples': [{'function': function, 'count': count} for function, count in samples],
+    }
+
+
+def setup(hass, config):
+    global _STATS
+
+    _STATS = {}
+
+    if config[DOMAIN][CONF_SAMPLING]:
+        _start_sampler(config[DOMAIN][CONF_SAMPLING_INTERVAL])
+
+    def dump(call):
+        data = summary()
+        for name, entry in data['calls'].items():
+            _LOGGER.info("{}: {calls} calls, {total} s total, {mean} s mean, {max} s max, {bytes} bytes".format(
+                name, **entry))
+        for sample in data['samples']:
+            _LOGGER.info("{function}: {count} samples".format(**sample))
+        hass.bus.fire(EVENT_SUMMARY, data)
+
+    def reset(call):
+        with _LOCK:
+            _STATS.clear()
+        if _SAMPLER is not None:
+            _SAMPLER.clear()
+
+    def sampling(call):
+        if call.data[ATTR_ENABLED]:
+            _start_sampler(config[DOMAIN][CONF_SAMPLING_INTERVAL])
+        else:
+            _stop_sampler()
+
+    def profiler_stop(event):
+        _stop_sampler()
+
+    hass.services.register(DOMAIN, SERVICE_DUMP, dump)
+    hass.services.register(DOMAIN, SERVICE_RESET, reset)
+    hass.services.register(
+        DOMAIN, SERVICE_SAMPLING, sampling, schema=SERVICE_SAMPLING_SCHEMA)
+    hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, profiler_stop)
+
+    return True
+
+
+def _start_sampler(interval):
+    global _SAMPLER
+
+    if _SAMPLER is None:
+        _SAMPLER = _Sampler(interval)
+        _SAMPLER.start()
+
+
+def _stop_sampler():
+    global _SAMPLER
+
+    if _SAMPLER is not None:
+        _SAMPLER.stop()
+        _SAMPLER = None
+
+
+class _Sampler(threading.Thread):
+    """Count the functions of the custom components that threads are in."""
+
+    def __init__(self, interval):
+        super().__init__(name='component_profiler', daemon=True)
+        self._interval = interval
+        self._stopper = threading.Event()
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def run(self):
+        ident = threading.get_ident()
+        while not self._stopper.wait(self._interval):
+            for thread_ident, frame in sys._current_frames().items():
+                if thread_ident == ident:
+                    continue
+
+                # Innermost frame in one of the custom components
+                while frame is not None and 'custom_components' not in frame.f_code.co_filename:
+                    frame = frame.f_back
+                if frame is None:
+                    continue
+
+                function = '{}:{}'.format(
+                    os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                with self._lock:
+                    self._counts[function] += 1
+
+    def stop(self):
+        self._stopper.set()
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+    def most_common(self, count):
+        with self._lock:
+            return self._counts.most_common(count)
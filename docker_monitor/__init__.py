@@ -4,12 +4,18 @@ Docker Monitor component
 For more details about this component, please refer to the documentation at
 https://github.com/Sanderhuisman/home-assistant-custom-components
 '''
+import heapq
+import http.server
+import itertools
 import logging
+import re
+import socketserver
 import threading
 import time
 from datetime import timedelta
 
 import homeassistant.helpers.config_validation as cv
+import homeassistant.util.dt as dt_util
 import voluptuous as vol
 from homeassistant.const import (
     ATTR_ATTRIBUTION,
@@ -17,11 +23,22 @@ from homeassistant.const import (
     CONF_NAME,
     CONF_SCAN_INTERVAL,
     CONF_URL,
+    CONF_VERIFY_SSL,
     EVENT_HOMEASSISTANT_STOP
 )
 from homeassistant.core import callback
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.discovery import load_platform
+from homeassistant.helpers.storage import STORAGE_DIR
 from homeassistant.util import slugify as util_slugify
+from homeassistant.util.json import load_json, save_json
+
+try:
+    from custom_components.component_profiler import record as profile_record
+except ImportError:
+    def profile_record(name, seconds, size=0):
+        """Nothing is recorded without the component profiler."""
+        pass
 
 VERSION = '0.0.3'
 
@@ -38,6 +55,14 @@ DATA_DOCKER_API = 'api'
 DATA_CONFIG = 'config'
 
 EVENT_CONTAINER = 'container_event'
+EVENT_CONTAINER_TOP = 'container_top'
+
+SERVICE_TOP = 'top'
+
+ATTR_CONTAINER = 'container'
+ATTR_MAX_AGE = 'max_age'
+
+BASELINES_FILE = 'docker_monitor.baselines'
 
 PRECISION = 2
 
@@ -46,6 +71,25 @@ DEFAULT_NAME = 'Docker'
 
 DEFAULT_SCAN_INTERVAL = timedelta(seconds=10)
 
+# Connections kept open to a remote daemon, every stats and log stream holds
+# one, and the number of concurrent stats, inspect and control calls
+DEFAULT_POOL_SIZE = 32
+DEFAULT_MAX_API_CALLS = 4
+
+# Priority of calls to the daemon, lower goes first
+PRIORITY_CONTROL = 0
+PRIORITY_INSPECT = 1
+PRIORITY_STATS = 2
+DEFAULT_LOG_ERROR_PATTERN = r'(?i)\b(error|exception|fatal|critical)\b'
+
+# Longest partial log line kept between two chunks of the log stream
+LOG_MAX_LINE_LENGTH = 4096
+
+# Process snapshots are cached and never taken more often than the minimum age
+TOP_CACHE_TTL = 30
+TOP_MIN_AGE = 10
+TOP_MAX_PROCESSES = 10
+
 DOCKER_TYPE = [
     'sensor',
     'switch'
@@ -53,6 +97,14 @@ DOCKER_TYPE = [
 
 CONF_EVENTS = 'events'
 CONF_CONTAINERS = 'containers'
+CONF_LOG_ERROR_PATTERN = 'log_error_pattern'
+CONF_PROMETHEUS_PORT = 'prometheus_port'
+CONF_TOP_CPU_THRESHOLD = 'top_cpu_threshold'
+CONF_TLS_CA_CERT = 'tls_ca_cert'
+CONF_TLS_CLIENT_CERT = 'tls_client_cert'
+CONF_TLS_CLIENT_KEY = 'tls_client_key'
+CONF_POOL_SIZE = 'pool_size'
+CONF_MAX_API_CALLS = 'max_api_calls'
 
 UTILISATION_MONITOR_VERSION = 'utilization_version'
 
@@ -66,6 +118,11 @@ CONTAINER_MONITOR_NETWORK_SPEED_UP = 'container_network_speed_up'
 CONTAINER_MONITOR_NETWORK_SPEED_DOWN = 'container_network_speed_down'
 CONTAINER_MONITOR_NETWORK_TOTAL_UP = 'container_network_total_up'
 CONTAINER_MONITOR_NETWORK_TOTAL_DOWN = 'container_network_total_down'
+CONTAINER_MONITOR_HEALTH = 'container_health'
+CONTAINER_MONITOR_RESTART_COUNT = 'container_restart_count'
+CONTAINER_MONITOR_OOM_KILLED = 'container_oom_killed'
+CONTAINER_MONITOR_LOG_LINES = 'container_log_lines'
+CONTAINER_MONITOR_LOG_ERRORS = 'container_log_errors'
 
 _UTILISATION_MON_COND = {
     UTILISATION_MONITOR_VERSION: ['Version', None, 'mdi:information-outline', None],
@@ -82,12 +139,42 @@ _CONTAINER_MON_COND = {
     CONTAINER_MONITOR_NETWORK_SPEED_DOWN: ['Network speed Down', 'kB/s', 'mdi:download', None],
     CONTAINER_MONITOR_NETWORK_TOTAL_UP: ['Network total Up', 'MB', 'mdi:upload', None],
     CONTAINER_MONITOR_NETWORK_TOTAL_DOWN: ['Network total Down', 'MB', 'mdi:download', None],
+    CONTAINER_MONITOR_HEALTH: ['Health', None, 'mdi:heart-pulse', None],
+    CONTAINER_MONITOR_RESTART_COUNT: ['Restart count', None, 'mdi:restart', None],
+    CONTAINER_MONITOR_OOM_KILLED: ['OOM killed', None, 'mdi:memory', None],
+    CONTAINER_MONITOR_LOG_LINES: ['Log lines', 'lines/s', 'mdi:text', None],
+    CONTAINER_MONITOR_LOG_ERRORS: ['Log errors', 'errors/min', 'mdi:alert-circle-outline', None],
 }
 
+# Conditions kept up to date from the Docker event stream
+_EVENT_MON_COND = [
+    CONTAINER_MONITOR_HEALTH,
+    CONTAINER_MONITOR_RESTART_COUNT,
+    CONTAINER_MONITOR_OOM_KILLED,
+]
+
+# Conditions that follow the log stream, only enabled on request
+_LOG_MON_COND = [
+    CONTAINER_MONITOR_LOG_LINES,
+    CONTAINER_MONITOR_LOG_ERRORS,
+]
+
 _MONITORED_CONDITIONS = \
     list(_UTILISATION_MON_COND.keys()) + \
     list(_CONTAINER_MON_COND.keys())
 
+_DEFAULT_MONITORED_CONDITIONS = [
+    condition for condition in _MONITORED_CONDITIONS if condition not in _LOG_MON_COND]
+
+
+def _compile_log_pattern(value):
+    """Validate and compile a regular expression for the raw log lines."""
+    try:
+        return re.compile(cv.string(value).encode('utf-8'))
+    except re.error as e:
+        raise vol.Invalid("Invalid log error pattern ({})".format(e))
+
+
 CONFIG_SCHEMA = vol.Schema({
     DOMAIN: vol.Schema({
         vol.Optional(CONF_NAME, default=DEFAULT_NAME):
@@ -98,21 +185,56 @@ CONFIG_SCHEMA = vol.Schema({
             cv.time_period,
         vol.Optional(CONF_EVENTS, default=False):
             cv.boolean,
-        vol.Optional(CONF_MONITORED_CONDITIONS, default=_MONITORED_CONDITIONS):
+        vol.Optional(CONF_MONITORED_CONDITIONS, default=_DEFAULT_MONITORED_CONDITIONS):
             vol.All(cv.ensure_list, [vol.In(_MONITORED_CONDITIONS)]),
         vol.Optional(CONF_CONTAINERS):
             cv.ensure_list,
+        vol.Optional(CONF_LOG_ERROR_PATTERN, default=DEFAULT_LOG_ERROR_PATTERN):
+            _compile_log_pattern,
+        vol.Optional(CONF_PROMETHEUS_PORT):
+            cv.port,
+        vol.Optional(CONF_TOP_CPU_THRESHOLD):
+            vol.Coerce(float),
+        vol.Optional(CONF_TLS_CA_CERT):
+            cv.isfile,
+        vol.Inclusive(CONF_TLS_CLIENT_CERT, 'tls_client'):
+            cv.isfile,
+        vol.Inclusive(CONF_TLS_CLIENT_KEY, 'tls_client'):
+            cv.isfile,
+        vol.Optional(CONF_VERIFY_SSL, default=True):
+            cv.boolean,
+        vol.Optional(CONF_POOL_SIZE, default=DEFAULT_POOL_SIZE):
+            cv.positive_int,
+        vol.Optional(CONF_MAX_API_CALLS, default=DEFAULT_MAX_API_CALLS):
+            cv.positive_int,
     })
 }, extra=vol.ALLOW_EXTRA)
 
+SERVICE_TOP_SCHEMA = vol.Schema({
+    vol.Required(ATTR_CONTAINER): cv.string,
+    vol.Optional(ATTR_MAX_AGE, default=TOP_CACHE_TTL): vol.Coerce(int),
+})
+
 
 def setup(hass, config):
     _LOGGER.info("Settings: {}".format(config[DOMAIN]))
 
     host = config[DOMAIN].get(CONF_URL)
 
+    tls = None
+    if any(key in config[DOMAIN] for key in (CONF_TLS_CA_CERT, CONF_TLS_CLIENT_CERT)):
+        tls = {
+            CONF_TLS_CA_CERT: config[DOMAIN].get(CONF_TLS_CA_CERT),
+            CONF_TLS_CLIENT_CERT: config[DOMAIN].get(CONF_TLS_CLIENT_CERT),
+            CONF_TLS_CLIENT_KEY: config[DOMAIN].get(CONF_TLS_CLIENT_KEY),
+            CONF_VERIFY_SSL: config[DOMAIN][CONF_VERIFY_SSL],
+        }
+
     try:
-        api = DockerAPI(host)
+        api = DockerAPI(
+            host, tls,
+            config[DOMAIN][CONF_POOL_SIZE],
+            config[DOMAIN][CONF_MAX_API_CALLS])
     except (ImportError, ConnectionError) as e:
         _LOGGER.info("Error setting up Docker API ({})".format(e))
         return False
@@ -121,6 +243,10 @@ def setup(hass, config):
         _LOGGER.debug("Docker version: {}".format(
             version.get('version', None)))
 
+        # Counters of the previous run, such that the first sample has rates
+        baselines_path = hass.config.path(STORAGE_DIR, BASELINES_FILE)
+        api.load_baselines(baselines_path)
+
         hass.data[DOCKER_HANDLE] = {}
         hass.data[DOCKER_HANDLE][DATA_DOCKER_API] = api
         hass.data[DOCKER_HANDLE][DATA_CONFIG] = {
@@ -128,15 +254,34 @@ def setup(hass, config):
             CONF_CONTAINERS: config[DOMAIN].get(CONF_CONTAINERS, [container.get_name() for container in api.get_containers()]),
             CONF_MONITORED_CONDITIONS: config[DOMAIN].get(CONF_MONITORED_CONDITIONS),
             CONF_SCAN_INTERVAL: config[DOMAIN].get(CONF_SCAN_INTERVAL),
+            CONF_LOG_ERROR_PATTERN: config[DOMAIN].get(CONF_LOG_ERROR_PATTERN),
+            CONF_TOP_CPU_THRESHOLD: config[DOMAIN].get(CONF_TOP_CPU_THRESHOLD),
         }
 
         for component in DOCKER_TYPE:
             load_platform(hass, component, DOMAIN, {}, config)
 
+        exporter = None
+        if CONF_PROMETHEUS_PORT in config[DOMAIN]:
+            exporter = PrometheusExporter(
+                api,
+                hass.data[DOCKER_HANDLE][DATA_CONFIG][CONF_CONTAINERS],
+                config[DOMAIN][CONF_PROMETHEUS_PORT],
+                config[DOMAIN][CONF_SCAN_INTERVAL].total_seconds())
+            try:
+                exporter.start()
+            except OSError as e:
+                _LOGGER.error("Cannot serve Prometheus metrics on port {} ({})".format(
+                    config[DOMAIN][CONF_PROMETHEUS_PORT], e))
+                exporter = None
+
         def monitor_stop(_service_or_event):
             """Stop the monitor thread."""
             _LOGGER.info("Stopping threads for Docker monitor")
+            if exporter is not None:
+                exporter.stop()
             api.exit()
+            api.save_baselines(baselines_path)
 
         hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, monitor_stop)
 
@@ -145,8 +290,30 @@ def setup(hass, config):
             _LOGGER.debug("Sending event {} notification with message {}".format(event, message))
             hass.bus.fire(event, message)
 
+        def top_service(call):
+            """Capture the processes of a container and fire them as event."""
+            name = call.data[ATTR_CONTAINER]
+            container = api.get_container(name)
+            if container is None:
+                _LOGGER.error("Unknown container {}".format(name))
+                return
+
+            snapshot = container.top(call.data[ATTR_MAX_AGE])
+            if snapshot is not None:
+                event = util_slugify("{} {}".format(config[DOMAIN][CONF_NAME], EVENT_CONTAINER_TOP))
+                hass.bus.fire(event, {
+                    'Container': name,
+                    'Time': snapshot['time'],
+                    'Processes': snapshot['processes'],
+                })
+
+        hass.services.register(DOMAIN, SERVICE_TOP, top_service, schema=SERVICE_TOP_SCHEMA)
+
         if config[DOMAIN][CONF_EVENTS]:
             api.events(event_listener)
+        elif any(condition in _EVENT_MON_COND for condition in config[DOMAIN][CONF_MONITORED_CONDITIONS]):
+            # Health, restarts and OOM kills are driven by the event stream
+            api.events()
 
         return True
 
@@ -155,9 +322,64 @@ def setup(hass, config):
 Docker API abstraction
 """
 
+_DATEUTIL_PARSER = None
+
+
+def _parse_datetime(value):
+    """Parse a timestamp of the Docker API, dateutil is imported on first use."""
+    global _DATEUTIL_PARSER
+    if _DATEUTIL_PARSER is None:
+        from dateutil import parser
+        _DATEUTIL_PARSER = parser
+    return _DATEUTIL_PARSER.parse(value)
+
+
+class _PriorityLimiter:
+    """Limit concurrent calls, waiting calls are served by priority.
+
+    Control calls are never queued, such that starting or stopping a
+    container does not wait behind stats and inspect calls.
+    """
+
+    def __init__(self, max_calls):
+        self._max_calls = max_calls
+        self._active = 0
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._counter = itertools.count()
+
+    def acquire(self, priority):
+        with self._lock:
+            if priority == PRIORITY_CONTROL or (
+                    self._active < self._max_calls and not self._waiting):
+                self._active += 1
+                return
+
+            event = threading.Event()
+            heapq.heappush(self._waiting, (priority, next(self._counter), event))
+
+        # The slot is handed over by release
+        event.wait()
+
+    def release(self):
+        with self._lock:
+            if self._waiting and self._active <= self._max_calls:
+                _, _, event = heapq.heappop(self._waiting)
+                event.set()
+            else:
+                self._active -= 1
+
+    def call(self, priority, function, *args, **kwargs):
+        self.acquire(priority)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.release()
+
 
 class DockerAPI:
-    def __init__(self, base_url):
+    def __init__(self, base_url, tls=None, pool_size=DEFAULT_POOL_SIZE,
+                 max_api_calls=DEFAULT_MAX_API_CALLS):
         self._base_url = base_url
         try:
             import docker
@@ -167,10 +389,25 @@ class DockerAPI:
 
         self._containers = {}
         self._event_callback_listeners = []
+        self._event_thread = None
         self._events = None
 
+        self._limiter = _PriorityLimiter(max_api_calls)
+
         try:
-            self._client = docker.DockerClient(base_url=self._base_url)
+            tls_config = False
+            if tls is not None:
+                tls_config = docker.tls.TLSConfig(
+                    client_cert=(tls[CONF_TLS_CLIENT_CERT], tls[CONF_TLS_CLIENT_KEY])
+                    if tls[CONF_TLS_CLIENT_CERT] else None,
+                    ca_cert=tls[CONF_TLS_CA_CERT],
+                    verify=tls[CONF_VERIFY_SSL])
+
+            self._client = docker.DockerClient(base_url=self._base_url, tls=tls_config)
+
+            # Remote daemons are reached through a pool of HTTP connections
+            if re.match(r'(tcp|http|https)://', self._base_url or ''):
+                self._resize_pool(tls_config, pool_size)
         except Exception as e:
             _LOGGER.error("Can not connect to Docker ({})".format(e))
             raise ConnectionError()
@@ -178,7 +415,23 @@ class DockerAPI:
         for container in self._client.containers.list(all=True) or []:
             _LOGGER.debug("Found container: {}".format(container.name))
             self._containers[container.name] = DockerContainerAPI(
-                self._client, container.name)
+                self._client, container.name, self._limiter)
+
+    def _resize_pool(self, tls_config, pool_size):
+        """Mount an adapter that keeps pool_size connections to the daemon."""
+        if tls_config:
+            from docker.transport import SSLAdapter
+            adapter = SSLAdapter(
+                ssl_version=tls_config.ssl_version,
+                assert_hostname=tls_config.assert_hostname,
+                assert_fingerprint=tls_config.assert_fingerprint,
+                pool_maxsize=pool_size)
+            self._client.api.mount('https://', adapter)
+        else:
+            from requests.adapters import HTTPAdapter
+            adapter = HTTPAdapter(pool_maxsize=pool_size)
+            self._client.api.mount('http://', adapter)
+            self._client.api.mount('https://', adapter)
 
     def exit(self):
         _LOGGER.info("Stopping threads for Docker monitor")
@@ -187,18 +440,19 @@ class DockerAPI:
         for container in self._containers.values():
             container.exit()
 
-    def events(self, callback):
-        if not self._event_callback_listeners:
+    def events(self, callback=None):
+        if self._event_thread is None:
             thread = threading.Thread(target=self._runnable, kwargs={})
+            self._event_thread = thread
             thread.start()
 
-        if callback not in self._event_callback_listeners:
+        if callback is not None and callback not in self._event_callback_listeners:
             self._event_callback_listeners.append(callback)
 
     def get_info(self):
         version = {}
         try:
-            raw_stats = self._client.version()
+            raw_stats = self._limiter.call(PRIORITY_INSPECT, self._client.version)
             version = {
                 'version': raw_stats.get('Version', None),
                 'api_version': raw_stats.get('ApiVersion', None),
@@ -226,12 +480,37 @@ class DockerAPI:
                     }
                     _LOGGER.info("Container event: ({})".format(message))
 
+                    container = self._containers.get(message['Container'])
+                    if container is not None:
+                        container.event(message['Status'])
+
                     for callback in self._event_callback_listeners:
                         callback(message)
             except KeyError as e:
                 _LOGGER.error("Key error: ({})".format(e))
                 pass
 
+    def load_baselines(self, path):
+        """Restore the counter snapshots per container ID from disk."""
+        baselines = load_json(path, default={})
+        for container in self._containers.values():
+            baseline = baselines.get(container.get_id())
+            if baseline is not None:
+                container.set_baseline(baseline)
+
+    def save_baselines(self, path):
+        """Store the last counter snapshots per container ID on disk."""
+        baselines = {}
+        for container in self._containers.values():
+            baseline = container.get_baseline()
+            if baseline is not None:
+                baselines[container.get_id()] = baseline
+
+        try:
+            save_json(path, baselines)
+        except HomeAssistantError as e:
+            _LOGGER.error("Cannot save Docker monitor baselines ({})".format(e))
+
     def get_containers(self):
         return list(self._containers.values())
 
@@ -243,59 +522,242 @@ class DockerAPI:
 
 
 class DockerContainerAPI:
-    def __init__(self, client, name):
+    def __init__(self, client, name, limiter=None):
         self._client = client
         self._name = name
+        self._limiter = limiter if limiter is not None else _PriorityLimiter(DEFAULT_MAX_API_CALLS)
 
         self._subscribers = []
 
-        self._container = client.containers.get(self._name)
+        self._container = self._limiter.call(
+            PRIORITY_INSPECT, client.containers.get, self._name)
+
+        # Latest inspect result and sample, shared with the event thread
+        self._lock = threading.Lock()
+        self._info = None
+        self._stats = None
+
+        # Previous counters used to calculate rates
+        self._cpu_old = {}
+        self._network_old = {}
+        self._baseline = None
 
         self._thread = None
         self._stopper = None
 
+        self._top_lock = threading.Lock()
+        self._top = None
+        self._top_attempt = None
+
+        self._log_subscribers = []
+        self._log_thread = None
+        self._log_stopper = None
+        self._log_stream = None
+        self._log_pattern = None
+        self._log_counters = [0, 0, 0]  # lines, bytes, errors
+        self._log_stats = None
+
     def get_name(self):
         return self._name
 
+    def get_id(self):
+        return self._container.id
+
+    def set_baseline(self, baseline):
+        """Set counters of a previous run, checked against the first sample."""
+        self._baseline = baseline
+
+    def get_baseline(self):
+        """Return the last counters in a JSON serializable form."""
+        info = self._info
+        if info is None or not (self._cpu_old or self._network_old):
+            return None
+
+        network = None
+        if self._network_old:
+            network = dict(self._network_old)
+            network['read'] = network['read'].isoformat()
+
+        return {
+            'started': info['started'].isoformat(),
+            'cpu': self._cpu_old or None,
+            'network': network,
+        }
+
+    def _restore_baseline(self, info):
+        baseline = self._baseline
+        self._baseline = None
+
+        # Baselines are stored per container ID, but counters also restart
+        # with the container, so only a baseline of the same run is valid.
+        if baseline.get('started') != info['started'].isoformat():
+            _LOGGER.debug("Discard stale baseline for container {}".format(self._name))
+            return
+
+        if baseline.get('cpu'):
+            self._cpu_old = baseline['cpu']
+        if baseline.get('network'):
+            network = dict(baseline['network'])
+            network['read'] = _parse_datetime(network['read'])
+            self._network_old = network
+
+        _LOGGER.debug("Restored baseline for container {}".format(self._name))
+
     # Call from DockerAPI
     def exit(self, timeout=None):
         """Stop the thread."""
         _LOGGER.debug("Close stats thread for container {}".format(self._name))
         if self._thread is not None:
             self._stopper.set()
+        if self._log_thread is not None:
+            self._log_stopper.set()
+            if self._log_stream is not None:
+                self._log_stream.close()
 
-    def stats(self, callback, interval=10):
-        if not self._subscribers:
+    def stats(self, callback=None, interval=10):
+        if self._thread is None:
             self._stopper = threading.Event()
             thread = threading.Thread(target=self._runnable, kwargs={
                                       'interval': interval})
             self._thread = thread
             thread.start()
 
-        if callback not in self._subscribers:
+        if callback is not None and callback not in self._subscribers:
             self._subscribers.append(callback)
 
-    def get_info(self):
-        from dateutil import parser
+    def get_stats(self):
+        """Return the latest sample, without contacting the daemon."""
+        return self._stats
+
+    def get_log_stats(self):
+        """Return the latest log sample, without contacting the daemon."""
+        return self._log_stats
+
+    def logs(self, callback, interval=10, pattern=None):
+        """Follow the log stream and report line and error rates.
+
+        The pattern is compiled by _compile_log_pattern, the default error
+        pattern is used if it is not given.
+        """
+        if not self._log_subscribers:
+            self._log_stopper = threading.Event()
+            self._log_pattern = pattern if pattern is not None else \
+                _compile_log_pattern(DEFAULT_LOG_ERROR_PATTERN)
+            thread = threading.Thread(target=self._log_runnable)
+            self._log_thread = thread
+            thread.start()
 
-        self._container.reload()
+            reporter = threading.Thread(target=self._log_reporter, kwargs={
+                                        'interval': interval})
+            reporter.start()
+
+        if callback not in self._log_subscribers:
+            self._log_subscribers.append(callback)
+
+    def get_info(self, priority=PRIORITY_INSPECT):
+        self._limiter.call(priority, self._container.reload)
+        state = self._container.attrs['State']
         info = {
             'id': self._container.id,
             'image': self._container.image.tags,
-            'status': self._container.attrs['State']['Status'],
-            'created': parser.parse(self._container.attrs['Created']),
-            'started': parser.parse(self._container.attrs['State']['StartedAt']),
+            'status': state['Status'],
+            'health': (state.get('Health') or {}).get('Status'),
+            'restart_count': self._container.attrs.get('RestartCount', 0),
+            'oom_killed': state.get('OOMKilled', False),
+            'created': _parse_datetime(self._container.attrs['Created']),
+            'started': _parse_datetime(state['StartedAt']),
         }
 
+        with self._lock:
+            self._info = info
+
         return info
 
+    # Call from DockerAPI
+    def event(self, status):
+        """Update the cached info from a Docker event and notify subscribers."""
+        with self._lock:
+            if self._stats is None:
+                # Nothing sampled yet, the first sample will pick it up
+                return
+            info = dict(self._info)
+
+        if status.startswith('health_status'):
+            # Status is formatted as 'health_status: healthy'
+            info['health'] = status.split(':', 1)[-1].strip()
+        elif status == 'oom':
+            info['oom_killed'] = True
+        elif status in ('die', 'start'):
+            # Restart count and exit state are only available through inspect
+            try:
+                info = self.get_info()
+            except Exception as e:
+                _LOGGER.error("Cannot inspect container {} ({})".format(self._name, e))
+                return
+        else:
+            return
+
+        with self._lock:
+            self._info = info
+            stats = dict(self._stats)
+            stats['info'] = info
+            self._stats = stats
+
+        self._notify(stats)
+
+    def top(self, max_age=TOP_CACHE_TTL):
+        """Return the processes of the container, at most one call per minimum age."""
+        max_age = max(max_age, TOP_MIN_AGE)
+        with self._top_lock:
+            # Failed attempts are limited by the same age as snapshots
+            now = time.time()
+            if self._top_attempt is not None and now - self._top_attempt < max_age:
+                return self._top
+            self._top_attempt = now
+
+            try:
+                raw = self._limiter.call(
+                    PRIORITY_INSPECT, self._container.top, ps_args='aux')
+                titles = raw['Titles']
+                pid = titles.index('PID')
+                cpu = titles.index('%CPU')
+                rss = titles.index('RSS')
+                command = titles.index('COMMAND')
+            except Exception as e:
+                _LOGGER.error("Cannot get processes of container {} ({})".format(self._name, e))
+                return self._top
+
+            processes = []
+            for process in raw.get('Processes') or []:
+                try:
+                    processes.append({
+                        'pid': int(process[pid]),
+                        'cpu': float(process[cpu]),
+                        'rss': int(process[rss]),  # kB
+                        'command': process[command],
+                    })
+                except (IndexError, ValueError):
+                    _LOGGER.debug("Cannot parse process {}".format(process))
+            processes.sort(key=lambda process: process['cpu'], reverse=True)
+
+            self._top = {
+                'timestamp': now,
+                'time': dt_util.utc_from_timestamp(now).isoformat(),
+                'processes': processes[:TOP_MAX_PROCESSES],
+            }
+            return self._top
+
+    def get_top(self):
+        """Return the cached process snapshot, without contacting the daemon."""
+        return self._top
+
     def start(self):
         _LOGGER.info("Start container {}".format(self._name))
-        self._container.start()
+        self._limiter.call(PRIORITY_CONTROL, self._container.start)
 
     def stop(self, timeout=10):
         _LOGGER.info("Stop container {}".format(self._name))
-        self._container.stop(timeout=timeout)
+        self._limiter.call(PRIORITY_CONTROL, self._container.stop, timeout=timeout)
 
     def _notify(self, message):
         _LOGGER.debug("Send notify for container {}".format(self._name))
@@ -303,21 +765,20 @@ class DockerContainerAPI:
             callback(message)
 
     def _runnable(self, interval):
-        from dateutil import parser
-
         stream = self._container.stats(stream=True, decode=True)
 
-        cpu_old = {}
-        network_old = {}
         for raw in stream:
             if self._stopper.isSet():
                 break
 
+            start = time.perf_counter()
             stats = {}
 
-            stats['info'] = self.get_info()
+            stats['info'] = self.get_info(PRIORITY_STATS)
+            if self._baseline is not None:
+                self._restore_baseline(stats['info'])
             if stats['info']['status'] in ('running', 'paused'):
-                stats['read'] = parser.parse(raw['read'])
+                stats['read'] = _parse_datetime(raw['read'])
 
                 cpu_stats = {}
                 try:
@@ -337,17 +798,17 @@ class DockerContainerAPI:
                         self._container.id, e))
                     _LOGGER.debug(raw)
                 else:
-                    if cpu_old:
-                        cpu_delta = float(cpu_new['total'] - cpu_old['total'])
+                    if self._cpu_old:
+                        cpu_delta = float(cpu_new['total'] - self._cpu_old['total'])
                         system_delta = float(
-                            cpu_new['system'] - cpu_old['system'])
+                            cpu_new['system'] - self._cpu_old['system'])
 
                         cpu_stats['total'] = round(0.0, PRECISION)
                         if cpu_delta > 0.0 and system_delta > 0.0:
                             cpu_stats['total'] = round(
                                 (cpu_delta / system_delta) * float(cpu_stats['online_cpus']) * 100.0, PRECISION)
 
-                    cpu_old = cpu_new
+                    self._cpu_old = cpu_new
 
                 memory_stats = {}
                 try:
@@ -387,15 +848,15 @@ class DockerContainerAPI:
                         self._container.id, e))
                     _LOGGER.debug(raw)
                 else:
-                    if network_old:
-                        tx = network_new['total_tx'] - network_old['total_tx']
-                        rx = network_new['total_rx'] - network_old['total_rx']
-                        tim = (network_new['read'] - network_old['read']).total_seconds()
+                    if self._network_old:
+                        tx = network_new['total_tx'] - self._network_old['total_tx']
+                        rx = network_new['total_rx'] - self._network_old['total_rx']
+                        tim = (network_new['read'] - self._network_old['read']).total_seconds()
 
                         network_stats['speed_tx'] = round(float(tx) / tim, PRECISION)
                         network_stats['speed_rx'] = round(float(rx) / tim, PRECISION)
 
-                    network_old = network_new
+                    self._network_old = network_new
 
                 stats['cpu'] = cpu_stats
                 stats['memory'] = memory_stats
@@ -405,5 +866,217 @@ class DockerContainerAPI:
                 stats['memory'] = {}
                 stats['network'] = {}
 
+            with self._lock:
+                self._stats = stats
+
             self._notify(stats)
+            profile_record('docker_monitor.stats', time.perf_counter() - start)
             time.sleep(interval)
+
+    def _log_runnable(self):
+        while not self._log_stopper.isSet():
+            try:
+                self._log_stream = self._container.logs(
+                    stream=True, follow=True, since=int(time.time()))
+
+                # Only the (truncated) tail of an unfinished line is kept, so
+                # memory stays constant whatever the log volume is.
+                partial = b''
+                for chunk in self._log_stream:
+                    if self._log_stopper.isSet():
+                        break
+
+                    lines = chunk.split(b'\n')
+                    lines[0] = partial + lines[0]
+                    partial = lines.pop()[:LOG_MAX_LINE_LENGTH]
+
+                    errors = 0
+                    for line in lines:
+                        if self._log_pattern.search(line):
+                            errors += 1
+
+                    with self._lock:
+                        self._log_counters[0] += len(lines)
+                        self._log_counters[1] += len(chunk)
+                        self._log_counters[2] += errors
+            except Exception as e:
+                _LOGGER.info("Cannot follow logs for container {} ({})".format(self._name, e))
+
+            # Stream ends when the container stops, wait before following again
+            self._log_stopper.wait(10)
+
+    def _log_reporter(self, interval):
+        last = time.time()
+        while not self._log_stopper.wait(interval):
+            now = time.time()
+            elapsed = now - last
+            last = now
+
+            with self._lock:
+                lines, size, errors = self._log_counters
+                self._log_counters = [0, 0, 0]
+
+            stats = {
+                'logs': {
+                    'lines_per_second': round(lines / elapsed, PRECISION),
+                    'bytes_per_second': round(size / elapsed, PRECISION),
+                    'errors_per_minute': round(errors * 60.0 / elapsed, PRECISION),
+                }
+            }
+            self._log_stats = stats
+
+            _LOGGER.debug("Send log notify for container {}".format(self._name))
+            for callback in self._log_subscribers:
+                callback(stats)
+
+
+"""
+Prometheus exporter
+"""
+
+
+def _prometheus_health(stats):
+    health = stats['info'].get('health')
+    if health is None:
+        return None
+    return 1 if health == 'healthy' else 0
+
+
+# Metric name, type, help text and function to get the value from a sample
+_PROMETHEUS_METRICS = [
+    ('docker_container_running', 'gauge', 'Container is running',
+     lambda stats, logs: 1 if stats['info']['status'] == 'running' else 0),
+    ('docker_container_healthy', 'gauge', 'Container health check is healthy',
+     lambda stats, logs: _prometheus_health(stats)),
+    ('docker_container_restart_count', 'gauge', 'Number of container restarts',
+     lambda stats, logs: stats['info'].get('restart_count')),
+    ('docker_container_oom_killed', 'gauge', 'Container was killed by the OOM killer',
+     lambda stats, logs: int(stats['info'].get('oom_killed', False))),
+    ('docker_container_cpu_percent', 'gauge', 'CPU usage in percent',
+     lambda stats, logs: stats['cpu'].get('total')),
+    ('docker_container_memory_usage_bytes', 'gauge', 'Memory usage in bytes',
+     lambda stats, logs: stats['memory'].get('usage')),
+    ('docker_container_memory_limit_bytes', 'gauge', 'Memory limit in bytes',
+     lambda stats, logs: stats['memory'].get('limit')),
+    ('docker_container_memory_percent', 'gauge', 'Memory usage in percent',
+     lambda stats, logs: stats['memory'].get('usage_percent')),
+    ('docker_container_network_tx_bytes_total', 'counter', 'Total bytes sent',
+     lambda stats, logs: stats['network'].get('total_tx')),
+    ('docker_container_network_rx_bytes_total', 'counter', 'Total bytes received',
+     lambda stats, logs: stats['network'].get('total_rx')),
+    ('docker_container_network_tx_bytes_per_second', 'gauge', 'Bytes sent per second',
+     lambda stats, logs: stats['network'].get('speed_tx')),
+    ('docker_container_network_rx_bytes_per_second', 'gauge', 'Bytes received per second',
+     lambda stats, logs: stats['network'].get('speed_rx')),
+    ('docker_container_log_lines_per_second', 'gauge', 'Log lines per second',
+     lambda stats, logs: logs['logs'].get('lines_per_second') if logs else None),
+    ('docker_container_log_errors_per_minute', 'gauge', 'Log error lines per minute',
+     lambda stats, logs: logs['logs'].get('errors_per_minute') if logs else None),
+]
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class PrometheusExporter:
+    """Serve the latest container samples as Prometheus metrics."""
+
+    def __init__(self, api, containers, port, interval=10):
+        self._port = port
+        self._interval = interval
+        self._server = None
+
+        self._containers = []
+        for name in containers:
+            container = api.get_container(name)
+            if container is not None:
+                self._containers.append(container)
+
+        # Metric headers are the same for every scrape
+        self._headers = [
+            '# HELP {0} {1}\n# TYPE {0} {2}\n'.format(name, help_text, kind).encode('utf-8')
+            for name, kind, help_text, _ in _PROMETHEUS_METRICS]
+
+        # Container name -> (sample, log sample, rendered line per metric)
+        self._cache = {}
+
+    def start(self):
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            # Buffer the many small writes of a scrape
+            wbufsize = 64 * 1024
+
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.end_headers()
+                exporter.write(self.wfile)
+
+            def log_message(self, format, *args):
+                _LOGGER.debug("Prometheus exporter: " + format, *args)
+
+        # Bind first, such that no stats are started if the port is in use
+        self._server = _ThreadingHTTPServer(('', self._port), Handler)
+
+        for container in self._containers:
+            container.stats(interval=self._interval)
+
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        _LOGGER.info("Serving Prometheus metrics on port {}".format(self._port))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def write(self, stream):
+        """Write all metrics, grouped per metric as the text format requires."""
+        rendered = [self._render(container) for container in self._containers]
+
+        for index, header in enumerate(self._headers):
+            stream.write(header)
+            for lines in rendered:
+                if lines is not None and lines[index] is not None:
+                    stream.write(lines[index])
+
+    def _render(self, container):
+        """Render the lines of a container, only when a new sample arrived."""
+        stats = container.get_stats()
+        if stats is None:
+            return None
+
+        logs = container.get_log_stats()
+
+        name = container.get_name()
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] is stats and cached[1] is logs:
+            return cached[2]
+
+        label = '{{container="{}"}}'.format(
+            name.replace('\\', '\\\\').replace('"', '\\"'))
+
+        lines = []
+        for metric, _, _, get_value in _PROMETHEUS_METRICS:
+            try:
+                value = get_value(stats, logs)
+            except (KeyError, TypeError):
+                value = None
+
+            if value is None:
+                lines.append(None)
+            else:
+                lines.append('{}{} {}\n'.format(metric, label, value).encode('utf-8'))
+
+        self._cache[name] = (stats, logs, lines)
+
+        return lines
@@ -19,17 +19,25 @@ from homeassistant.helpers.entity import Entity
 
 from custom_components.docker_monitor import (
     _CONTAINER_MON_COND,
+    _LOG_MON_COND,
     _UTILISATION_MON_COND,
     CONF_ATTRIBUTION,
     CONF_CONTAINERS,
+    CONF_LOG_ERROR_PATTERN,
+    CONF_TOP_CPU_THRESHOLD,
     CONTAINER_MONITOR_CPU_PERCENTAGE,
+    CONTAINER_MONITOR_HEALTH,
     CONTAINER_MONITOR_IMAGE,
+    CONTAINER_MONITOR_LOG_ERRORS,
+    CONTAINER_MONITOR_LOG_LINES,
     CONTAINER_MONITOR_MEMORY_PERCENTAGE,
     CONTAINER_MONITOR_MEMORY_USAGE,
     CONTAINER_MONITOR_NETWORK_SPEED_DOWN,
     CONTAINER_MONITOR_NETWORK_TOTAL_DOWN,
     CONTAINER_MONITOR_NETWORK_SPEED_UP,
     CONTAINER_MONITOR_NETWORK_TOTAL_UP,
+    CONTAINER_MONITOR_OOM_KILLED,
+    CONTAINER_MONITOR_RESTART_COUNT,
     CONTAINER_MONITOR_STATUS,
     CONTAINER_MONITOR_UPTIME,
     DATA_CONFIG,
@@ -47,9 +55,12 @@ _LOGGER = logging.getLogger(__name__)
 
 ATTR_CREATED = 'Created'
 ATTR_IMAGE = 'Image'
+ATTR_LOG_BYTES = 'Bytes_per_second'
 ATTR_MEMORY_LIMIT = 'Memory_limit'
 ATTR_ONLINE_CPUS = 'Online_CPUs'
 ATTR_STARTED_AT = 'Started_at'
+ATTR_TOP_PROCESSES = 'Top_processes'
+ATTR_TOP_TIME = 'Top_time'
 ATTR_VERSION_API = 'Api_version'
 ATTR_VERSION_ARCH = 'Architecture'
 ATTR_VERSION_OS = 'Os'
@@ -62,6 +73,8 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     config = hass.data[DOCKER_HANDLE][DATA_CONFIG]
     clientname = config[CONF_NAME]
     interval = config[CONF_SCAN_INTERVAL].total_seconds()
+    log_pattern = config[CONF_LOG_ERROR_PATTERN]
+    top_threshold = config[CONF_TOP_CPU_THRESHOLD]
 
     sensors = [DockerUtilSensor(api, clientname, variable, interval)
                for variable in config[CONF_MONITORED_CONDITIONS] if variable in _UTILISATION_MON_COND]
@@ -69,7 +82,7 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     containers = [container.get_name() for container in api.get_containers()]
     for name in config[CONF_CONTAINERS]:
         if name in containers:
-            sensors += [DockerContainerSensor(api, clientname, name, variable, interval)
+            sensors += [DockerContainerSensor(api, clientname, name, variable, interval, log_pattern, top_threshold)
                         for variable in config[CONF_MONITORED_CONDITIONS] if variable in _CONTAINER_MON_COND]
 
     if sensors:
@@ -146,7 +159,7 @@ class DockerUtilSensor(Entity):
 class DockerContainerSensor(Entity):
     """Representation of a Docker Sensor."""
 
-    def __init__(self, api, clientname, container_name, variable, interval):
+    def __init__(self, api, clientname, container_name, variable, interval, log_pattern, top_threshold):
         """Initialize the sensor."""
         self._api = api
         self._clientname = clientname
@@ -180,6 +193,12 @@ class DockerContainerSensor(Entity):
                     state = dt_util.as_local(up_time).isoformat()
             elif self._var_id == CONTAINER_MONITOR_IMAGE:
                 state = stats['info']['image'][0]  # get first from array
+            elif self._var_id == CONTAINER_MONITOR_HEALTH:
+                state = stats['info'].get('health')
+            elif self._var_id == CONTAINER_MONITOR_RESTART_COUNT:
+                state = stats['info'].get('restart_count')
+            elif self._var_id == CONTAINER_MONITOR_OOM_KILLED:
+                state = stats['info'].get('oom_killed')
             # cpu
             elif self._var_id == CONTAINER_MONITOR_CPU_PERCENTAGE:
                 state = stats.get('cpu', {}).get('total')
@@ -208,6 +227,18 @@ class DockerContainerSensor(Entity):
                 down = stats.get('network', {}).get('total_rx')
                 if down is not None:
                     state = round(down / (1024 ** 2), PRECISION)
+            # logs
+            elif self._var_id == CONTAINER_MONITOR_LOG_LINES:
+                state = stats.get('logs', {}).get('lines_per_second')
+            elif self._var_id == CONTAINER_MONITOR_LOG_ERRORS:
+                state = stats.get('logs', {}).get('errors_per_minute')
+
+            # Capture the processes when the CPU usage crosses the threshold
+            if self._var_id == CONTAINER_MONITOR_CPU_PERCENTAGE and top_threshold is not None and state is not None:
+                if state >= top_threshold and (self._state is None or self._state < top_threshold):
+                    _LOGGER.info("CPU usage of container {} crossed {}%".format(
+                        self._container_name, top_threshold))
+                    self._container.top()
 
             self._state = state
 
@@ -222,15 +253,26 @@ class DockerContainerSensor(Entity):
                 cpus = stats.get('cpu', {}).get('online_cpus')
                 if cpus is not None:
                     self._attributes[ATTR_ONLINE_CPUS] = cpus
+                top = self._container.get_top()
+                if top is not None:
+                    self._attributes[ATTR_TOP_PROCESSES] = top['processes']
+                    self._attributes[ATTR_TOP_TIME] = top['time']
             elif self._var_id in (CONTAINER_MONITOR_MEMORY_USAGE, CONTAINER_MONITOR_MEMORY_PERCENTAGE):
                 limit = stats.get('memory', {}).get('limit')
                 if limit is not None:
                     self._attributes[ATTR_MEMORY_LIMIT] = str(
                         round(limit / (1024 ** 2), PRECISION)) + ' MB'
+            elif self._var_id == CONTAINER_MONITOR_LOG_LINES:
+                size = stats.get('logs', {}).get('bytes_per_second')
+                if size is not None:
+                    self._attributes[ATTR_LOG_BYTES] = size
 
             self.schedule_update_ha_state()
 
-        self._container.stats(update_callback, self._interval)
+        if self._var_id in _LOG_MON_COND:
+            self._container.logs(update_callback, self._interval, log_pattern)
+        else:
+            self._container.stats(update_callback, self._interval)
 
     @property
     def name(self):
@@ -0,0 +1,371 @@
+'''
+Shared HTTP fetch layer
+
+Used by the scraping sensors, it does not need to be configured. For more
+details, please refer to the documentation at
+https://github.com/Sanderhuisman/home-assistant-custom-components
+'''
+import asyncio
+import logging
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+# Shared by all components, such that they work without the component profiler
+try:
+    from custom_components.component_profiler import record as profile_record
+except ImportError:
+    def profile_record(name, seconds, size=0):
+        """Nothing is recorded without the component profiler."""
+        pass
+
+VERSION = '0.0.3'
+
+_LOGGER = logging.getLogger(__name__)
+
+DOMAIN = 'http_fetch'
+
+DATA_HTTP_FETCH = 'http_fetch'
+
+# Requests per second and burst per host
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 10
+
+# Connections kept open and concurrent requests per host
+DEFAULT_POOL_SIZE = 4
+
+DEFAULT_CACHE_SIZE = 64
+
+# HTTP request timeout (connect, read) in seconds and retries of failed requests
+DEFAULT_TIMEOUT = (5, 15)
+REQUEST_RETRIES = 3
+REQUEST_BACKOFF = 0.5
+
+_RATE_LIMITS = None
+_RATE_LIMITS_LOCK = threading.Lock()
+
+
+def get_fetcher():
+    """Return a fetcher for one synchronous client.
+
+    Each client gets its own sessions, such that cookies of different
+    accounts are kept apart, but the rate limits per host are shared by all
+    synchronous clients.
+    """
+    global _RATE_LIMITS
+
+    with _RATE_LIMITS_LOCK:
+        if _RATE_LIMITS is None:
+            _RATE_LIMITS = RateLimits()
+    return Fetcher(rate_limits=_RATE_LIMITS)
+
+
+def async_get_fetcher(hass):
+    """Return the fetcher shared by all asynchronous platforms."""
+    fetcher = hass.data.get(DATA_HTTP_FETCH)
+    if fetcher is None:
+        from homeassistant.helpers.aiohttp_client import async_get_clientsession
+        fetcher = hass.data[DATA_HTTP_FETCH] = AsyncFetcher(
+            async_get_clientsession(hass))
+    return fetcher
+
+
+def _host(url):
+    return urllib.parse.urlsplit(url).netloc
+
+
+def _cache_key(url, params=None, kwargs=None):
+    """Return a key of a request, which includes the parameters, headers and other arguments."""
+    if not params and not kwargs:
+        return url
+    return (url, _freeze(params or {}), _freeze(kwargs or {}))
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(item) for item in value)
+    return value
+
+
+class TokenBucket:
+    """Rate limit of rate requests per second with bursts of capacity."""
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_BURST):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before it can be used.
+
+        Tokens can be taken in advance, such that waiting callers are served
+        in order.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= 1
+            return -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+
+class RateLimits:
+    """Token buckets per host, which can be shared by several fetchers."""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self._rate = rate
+        self._burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self._rate, self._burst)
+            return bucket
+
+
+class TTLCache:
+    """Values that expire after a time to live, least recently used are evicted first."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self._ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, None)
+        return value[0] if value is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SingleFlight:
+    """Run a function once for all threads that call it with the same key at the same time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, function):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = [threading.Event(), None, None]
+
+        if not leader:
+            flight[0].wait()
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1]
+
+        try:
+            flight[1] = function()
+        except Exception as e:
+            flight[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight[0].set()
+        return flight[1]
+
+
+class AsyncSingleFlight:
+    """Await a coroutine once for all tasks that request the same key at the same time."""
+
+    def __init__(self):
+        self._flights = {}
+
+    async def do(self, key, coroutine_function):
+        future = self._flights.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._flights[key] = asyncio.ensure_future(coroutine_function())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+
+
+class Fetcher:
+    """Blocking HTTP requests with a keep-alive session and rate limit per host.
+
+    Without rate_limits the fetcher has its own rate limits of rate requests
+    per second with bursts of burst requests.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 pool_size=DEFAULT_POOL_SIZE, cache_size=DEFAULT_CACHE_SIZE,
+                 rate_limits=None):
+        self._rate_limits = rate_limits if rate_limits is not None else RateLimits(rate, burst)
+        self._pool_size = pool_size
+
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+        self._cache = TTLCache(cache_size)
+        self._flights = SingleFlight()
+
+    def get(self, url, params=None, timeout=DEFAULT_TIMEOUT, ttl=None, **kwargs):
+        """Return the response of a GET request.
+
+        With ttl successful responses are cached for ttl seconds. Requests
+        for the same URL, parameters and other arguments at the same time are
+        done once.
+        """
+        key = _cache_key(url, params, kwargs)
+        if ttl is not None:
+            response = self._cache.get(key)
+            if response is not None:
+                return response
+
+        def fetch():
+            session, bucket = self._get_host(_host(url))
+            time.sleep(bucket.reserve())
+            response = session.get(url, params=params, timeout=timeout, **kwargs)
+            if ttl is not None and response.status_code == 200:
+                self._cache.set(key, response, ttl)
+            return response
+
+        return self._flights.do(key, fetch)
+
+    def invalidate(self, url, params=None, **kwargs):
+        """Remove a cached response."""
+        self._cache.pop(_cache_key(url, params, kwargs))
+
+    def _get_host(self, host):
+        with self._lock:
+            if host not in self._sessions:
+                self._sessions[host] = self._create_session()
+            return self._sessions[host], self._rate_limits.get(host)
+
+    def _create_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.packages.urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=REQUEST_RETRIES,
+            backoff_factor=REQUEST_BACKOFF,
+            status_forcelist=(500, 502, 503, 504))
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self._pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+
+class AsyncFetcher:
+    """Requests on the shared client session with a rate and concurrency limit per host."""
+
+    def __init__(self, session, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 limit_per_host=DEFAULT_POOL_SIZE, cache_size=DEFAULT_CACHE_SIZE):
+        self._session = session
+        self._rate = rate
+        self._burst = burst
+        self._limit_per_host = limit_per_host
+
+        self._buckets = {}
+        self._semaphores = {}
+
+        self._cache = TTLCache(cache_size)
+        self._flights = AsyncSingleFlight()
+
+    def request(self, url, method='GET', **kwargs):
+        """Return a context manager for the response of a request."""
+        host = _host(url)
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self._rate, self._burst)
+            self._semaphores[host] = asyncio.Semaphore(self._limit_per_host)
+        return _AsyncRequest(
+            self._session, self._buckets[host], self._semaphores[host], method, url, kwargs)
+
+    async def async_get_json(self, url, ttl=None, **kwargs):
+        """Return the decoded JSON response of a GET request.
+
+        With ttl the result is cached for ttl seconds. Requests for the same
+        URL and arguments at the same time are done once.
+        """
+        key = _cache_key(url, kwargs=kwargs)
+        if ttl is not None:
+            data = self._cache.get(key)
+            if data is not None:
+                return data
+
+        async def fetch():
+            async with self.request(url, **kwargs) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+            if ttl is not None:
+                self._cache.set(key, data, ttl)
+            return data
+
+        return await self._flights.do(key, fetch)
+
+
+class _AsyncRequest:
+
+    def __init__(self, session, bucket, semaphore, method, url, kwargs):
+        self._session = session
+        self._bucket = bucket
+        self._semaphore = semaphore
+        self._method = method
+        self._url = url
+        self._kwargs = kwargs
+        self._response = None
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            await asyncio.sleep(self._bucket.reserve())
+            self._response = await self._session.request(
+                self._method, self._url, **self._kwargs)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self._response
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            self._response.release()
+        finally:
+            self._semaphore.release()
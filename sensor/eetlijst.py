@@ -4,24 +4,33 @@ Support for Eetlijst Sensors.
 For more details about this platform, please refer to the documentation at
 https://github.com/Sanderhuisman/home-assistant-custom-components
 """
+import hashlib
 import logging
 import re
+import threading
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from html.parser import HTMLParser
 
 import homeassistant.helpers.config_validation as cv
-import pytz
-import requests
+import homeassistant.util.dt as dt_util
 import voluptuous as vol
-from bs4 import BeautifulSoup
 from homeassistant.components.sensor import PLATFORM_SCHEMA
 from homeassistant.const import (
     ATTR_ATTRIBUTION,
     CONF_PASSWORD,
-    CONF_USERNAME
+    CONF_USERNAME,
+    EVENT_HOMEASSISTANT_STOP
 )
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.entity import Entity
-from homeassistant.util import Throttle
+from homeassistant.helpers.event import call_later
+from homeassistant.helpers.storage import STORAGE_DIR
+from homeassistant.util.json import load_json, save_json
+
+from custom_components.http_fetch import TTLCache, get_fetcher, profile_record
 
 VERSION = '0.0.3'
 
@@ -31,7 +40,44 @@ _LOGGER = logging.getLogger(__name__)
 
 CONF_ATTRIBUTION = 'Data provided by Eetlijst'
 
-MIN_TIME_BETWEEN_UPDATES = timedelta(minutes=5)
+ATTR_DATE = 'date'
+ATTR_DEADLINE = 'deadline'
+ATTR_GUESTS = 'guests'
+ATTR_LIST = 'list'
+ATTR_NEW_STATUS = 'new_status'
+ATTR_OLD_STATUS = 'old_status'
+ATTR_RESIDENT = 'resident'
+ATTR_STATUS = 'status'
+ATTR_UPCOMING = 'upcoming'
+
+EVENT_STATUS_CHANGED = 'eetlijst_status_changed'
+
+DOMAIN = 'eetlijst'
+
+DATA_EETLIJST = 'eetlijst'
+
+# Session and last statuses per username, to start from after a restart
+SNAPSHOTS_FILE = 'eetlijst.snapshots'
+
+SERVICE_SET_STATUS = 'set_status'
+
+STATUS_COOK = 'cook'
+STATUS_DINNER = 'dinner'
+STATUS_NO_DINNER = 'no_dinner'
+
+SERVICE_SET_STATUS_SCHEMA = vol.Schema({
+    vol.Required(ATTR_RESIDENT): cv.string,
+    vol.Required(ATTR_STATUS): vol.In([STATUS_COOK, STATUS_DINNER, STATUS_NO_DINNER]),
+    vol.Optional(ATTR_GUESTS, default=0): vol.All(vol.Coerce(int), vol.Range(min=0)),
+    vol.Optional(ATTR_DATE): cv.date,
+    vol.Optional(ATTR_LIST): cv.string,
+})
+
+# Interval between refreshes of a list, the refreshes of the lists are
+# staggered and at most REFRESH_WORKERS lists are refreshed at the same time
+REFRESH_INTERVAL = timedelta(minutes=5)
+REFRESH_STAGGER = timedelta(seconds=30)
+REFRESH_WORKERS = 2
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Required(CONF_USERNAME): cv.string,
@@ -46,12 +92,25 @@ RE_JAVASCRIPT_VS_2 = re.compile(r"javascript:vs\(([0-9]*)\);")
 RE_JAVASCRIPT_K = re.compile(r"javascript:k\(([0-9]*),([-0-9]*),([-0-9]*)\);")
 RE_RESIDENTS = re.compile(r"Meer informatie over")
 RE_LAST_CHANGED = re.compile(r"onveranderd sinds ([0-9]+):([0-9]+)")
+RE_SESSION_ID = re.compile(r"session_id=[0-9a-zA-Z]*")
+
+# Number of characters fed to the parser at once
+PARSE_CHUNK_SIZE = 4096
 
-TIMEOUT_SESSION = 60 * 5
+# A session expires locally when it was not used for three refreshes, such
+# that each refresh reuses it. Sessions that expire earlier on the server
+# are detected by the redirect to login.php.
+TIMEOUT_SESSION = 3 * REFRESH_INTERVAL.total_seconds()
 TIMEOUT_CACHE = 60 * 5 / 2
 
-TZ_EETLIJST = pytz.timezone("Europe/Amsterdam")
-TZ_UTC = pytz.timezone("UTC")
+# HTTP request timeout (connect, read) in seconds
+TIMEOUT_REQUEST = (5, 15)
+
+TZ_EETLIJST = dt_util.get_time_zone("Europe/Amsterdam")
+TZ_UTC = dt_util.UTC
+
+# Only needed when the fast parser fails, imported on first use
+_BEAUTIFUL_SOUP = None
 
 
 def setup_platform(hass, config, add_entities, discovery_info=None):
@@ -61,76 +120,247 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     password = config.get(CONF_PASSWORD)
 
     try:
+        coordinator = hass.data.get(DATA_EETLIJST)
+        if coordinator is None:
+            coordinator = hass.data[DATA_EETLIJST] = EetlijstCoordinator(
+                hass, hass.config.path(STORAGE_DIR, SNAPSHOTS_FILE))
+            _setup_services(hass, coordinator)
+
         api = EetlijstApi(username, password)
 
+        # Start from the last statuses and refresh in the background, only
+        # wait for the list if it is not known yet
+        restored = api.restore(coordinator.get_snapshot(username))
+        if not restored:
+            api.update()
+
         sensors = []
         # Handle all containers
         for resident in api.residents:
             sensors.append(EetlijstSensor(api, api.accountname, resident))
 
-        add_entities(sensors, True)
+        def status_listener(changes):
+            residents = set()
+            for change in changes:
+                hass.bus.fire(EVENT_STATUS_CHANGED, change)
+                residents.add(change[ATTR_RESIDENT])
+
+            for sensor in sensors:
+                if sensor.resident in residents and sensor.hass is not None:
+                    sensor.schedule_update_ha_state()
+
+        api.subscribe(status_listener)
+
+        add_entities(sensors)
+        coordinator.add(api, sensors, refresh=restored)
     except:  # noqa: E722 pylint: disable=bare-except
         _LOGGER.error("Error setting up Eetlijst sensor")
 
 
+def _setup_services(hass, coordinator):
+    """Register the set status service for all lists."""
+
+    def set_status(call):
+        resident = call.data[ATTR_RESIDENT]
+        accountname = call.data.get(ATTR_LIST)
+
+        for api in coordinator.apis:
+            if accountname is not None and api.accountname != accountname:
+                continue
+            if api.residents and resident in api.residents:
+                break
+        else:
+            _LOGGER.error("Unknown resident {}".format(resident))
+            return
+
+        guests = call.data[ATTR_GUESTS]
+        status = call.data[ATTR_STATUS]
+        if status == STATUS_COOK:
+            value = 1 + guests
+        elif status == STATUS_DINNER:
+            value = -1 - guests
+        else:
+            value = 0
+
+        try:
+            api.set_status(resident, value, call.data.get(ATTR_DATE))
+        except Error as e:
+            _LOGGER.error("Cannot set status of {} ({})".format(resident, e))
+
+    hass.services.register(
+        DOMAIN, SERVICE_SET_STATUS, set_status, schema=SERVICE_SET_STATUS_SCHEMA)
+
+
+class EetlijstCoordinator:
+    """Refresh all lists and push the results to their sensors."""
+
+    def __init__(self, hass, path):
+        self._hass = hass
+        self._executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS)
+        self._sensors = {}
+        self._stopped = False
+
+        self._path = path
+        self._snapshots = load_json(path, default={})
+        self._snapshots_lock = threading.Lock()
+
+        self.apis = []
+
+        hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, self._stop)
+
+    def add(self, api, sensors, refresh=False):
+        """
+        Refresh a list periodically, staggered with the other lists. If
+        refresh is set, the first refresh is done right away.
+        """
+        self._sensors[api] = sensors
+
+        delay = REFRESH_STAGGER * len(self.apis)
+        if not refresh:
+            delay += REFRESH_INTERVAL
+        self._schedule(api, delay)
+        self.apis.append(api)
+
+    def get_snapshot(self, username):
+        """Return the stored snapshot of a list, if any."""
+        return self._snapshots.get(username)
+
+    def _save_snapshots(self):
+        with self._snapshots_lock:
+            for api in self.apis:
+                self._snapshots[api.username] = api.snapshot()
+
+            try:
+                save_json(self._path, self._snapshots)
+            except HomeAssistantError as e:
+                _LOGGER.error("Cannot save Eetlijst snapshots ({})".format(e))
+
+    def _schedule(self, api, delay):
+        if self._stopped:
+            return
+
+        def submit(now):
+            if not self._stopped:
+                self._executor.submit(self._refresh, api)
+
+        call_later(self._hass, delay.total_seconds(), submit)
+
+    def _refresh(self, api):
+        try:
+            api.update()
+        except (Error, IOError) as e:
+            _LOGGER.warning("Error updating Eetlijst {} ({})".format(api.accountname, e))
+        else:
+            for sensor in self._sensors[api]:
+                if sensor.hass is not None:
+                    sensor.schedule_update_ha_state()
+            self._save_snapshots()
+        finally:
+            self._schedule(api, REFRESH_INTERVAL)
+
+    def _stop(self, event):
+        self._stopped = True
+        self._executor.shutdown(wait=False)
+        self._save_snapshots()
+
+
 class EetlijstApi:
     """Class to interface with Synology DSM API."""
 
-    def __init__(self, username, password):
-        """Initialize the API wrapper class."""
+    def __init__(self, username, password, transport=None):
+        """Initialize the API wrapper class.
+
+        The transport performs the HTTP requests and defaults to a fetcher
+        with its own session, rate limited together with the other lists.
+        Another requests compatible session can be given instead.
+        """
 
         self.username = username
         self.password = password
 
+        self._transport = transport if transport is not None else get_fetcher()
+
         self.session = None
-        self.cache = {}
+        self.cache = TTLCache(ttl=TIMEOUT_CACHE)
+
+        # Key and status rows of the last parsed page, and how often parsing
+        # could be skipped because the page was unchanged
+        self._parsed = None
+        self.parse_hits = 0
+        self.parse_misses = 0
 
         # Initialize None
         self.accountname = None
         self.residents = None
         self.statuses = None
 
-        self._get_session()
-        self.get_statuses()
+        # Per resident (state, attributes) of the last update, and the status
+        # of each resident per day to find changes
+        self.states = {}
+        self._snapshot = None
+        self._subscribers = []
 
-    def get_statuses(self, limit=None):
-        content = self._main_page()
-        soup = self._get_soup(content)
-
-        # Find all names
-        self.residents = [x.nobr.b.text for x in soup.find_all(
-            ["th", "a"], title=RE_RESIDENTS)]
+        self._lock = threading.Lock()
 
-        # Grap the list name
-        self.accountname = soup.find(["head", "title"]).text.replace(
-            "Eetlijst.nl - ", "", 1).strip()
+    def get_statuses(self, limit=None):
+        """
+        Return a list of status rows, at most limit rows if given.
+        """
+        return list(self.iter_statuses(limit))
 
-        # Find the main table by first navigating to a unique cell.
-        start = soup.find(["table", "tbody", "tr", "th"], width="80")
-        if not start:
-            raise ScrapingError("Cannot parse status table")
+    def iter_statuses(self, limit=None):
+        """
+        Yield the status rows, starting with today. The page is only parsed as
+        far as the rows that are consumed, at most limit rows if given.
+        """
+        content = self._main_page()
 
-        rows = start.parent.parent.find_all("tr")
+        # Reuse the previous rows if the page did not change
+        key = self._page_key(content)
+        if self._parsed is not None:
+            parsed_key, parsed_limit, parsed = self._parsed
+            if parsed_key == key and (parsed_limit is None or (
+                    limit and limit <= parsed_limit)):
+                self.parse_hits += 1
+                profile_record('eetlijst.parse_hit', 0.0)
+                _LOGGER.debug("Page unchanged, reused {} status rows ({} hits, {} misses)".format(
+                    len(parsed), self.parse_hits, self.parse_misses))
+                yield from parsed[:limit]
+                return
+        self.parse_misses += 1
 
-        # Iterate over each status row
-        has_deadline = False
-        pattern = None
         results = []
-        start = 0
+        start = time.perf_counter()
+        for row in self._parse_statuses(content):
+            results.append(row)
+            yield row
 
-        for row in rows:
             # Check for limit
             if limit and len(results) >= limit:
                 break
 
+        elapsed = time.perf_counter() - start
+        profile_record('eetlijst.get_statuses', elapsed)
+        _LOGGER.debug("Parsed {} status rows from {} characters in {:.1f} ms".format(
+            len(results), len(content), elapsed * 1000))
+        self._parsed = (key, limit, results)
+
+    def _parse_statuses(self, content):
+        """
+        Decode the status rows of the main page while it is parsed.
+        """
+        has_deadline = None
+        pattern = None
+        start = 0
+
+        for row in self._page_rows(content):
             # Skip header rows
-            if len(row.find_all("th")) > 0:
+            if row.header:
                 continue
 
             # Check if the list uses deadlines
-            if len(results) == 0:
-                has_deadline = bool(
-                    row.find(["td", "a"], href=RE_JAVASCRIPT_VS_1))
+            if has_deadline is None:
+                has_deadline = row.deadline
 
             if has_deadline:
                 start = 2
@@ -140,25 +370,26 @@ class EetlijstApi:
                 pattern = RE_JAVASCRIPT_K
 
             # Match date and deadline
-            matches = re.search(pattern, str(row.renderContents()))
+            matches = re.search(pattern, row.markup)
+            if matches is None:
+                raise ScrapingError("Cannot parse date of status row.")
             timestamp = datetime.fromtimestamp(
                 int(matches.group(1)), tz=TZ_UTC)
 
             # Parse each cell for diner status
             statuses = []
-            for index, cell in enumerate(row.find_all("td")):
+            for index, (images, text) in enumerate(row.cells):
                 if index < start:
                     continue
 
                 # Count statuses
-                images = str(cell.renderContents())
                 nop = images.count("nop.gif")
                 kook = images.count("kook.gif")
                 eet = images.count("eet.gif")
                 leeg = images.count("leeg.gif")
 
                 # Match numbers, in case there are more than 4 images
-                extra = RE_DIGIT.findall(cell.text)
+                extra = RE_DIGIT.findall(text)
                 extra = int(extra[0]) if extra else 1
 
                 # Set the data
@@ -178,13 +409,80 @@ class EetlijstApi:
                 # Append to results
                 statuses.append(value)
 
-            # Append to results
-            results.append(StatusRow(
+            yield StatusRow(
                 timestamp=timestamp,
                 deadline=timestamp if has_deadline else None,
-                statuses=dict(zip(self.residents, statuses))))
+                statuses=dict(zip(self.residents, statuses)))
+
+    def _page_rows(self, content):
+        """
+        Yield the rows of the status table as soon as they are parsed. The
+        residents and list name are known before the first row is yielded.
+        """
+        parser = _StatusPageParser()
+        yielded = False
+
+        try:
+            for row in parser.iter_rows(content):
+                self.residents = parser.page.residents
+                self.accountname = parser.page.accountname
+                yielded = True
+                yield row
+        except ScrapingError as e:
+            if yielded:
+                raise
+
+            # Fall back to the complete, but much slower, document tree
+            _LOGGER.debug("Falling back to BeautifulSoup ({})".format(e))
+            page = self._parse_soup(content)
+
+            self.residents = page.residents
+            self.accountname = page.accountname
+            yield from page.rows
+            return
+
+        self.residents = parser.page.residents
+        self.accountname = parser.page.accountname
+
+    def _page_key(self, content):
+        """
+        Return a hash of the page that only changes when the list changes, by
+        leaving out the session id.
+        """
+        return hashlib.sha1(
+            RE_SESSION_ID.sub("", content).encode("utf-8")).hexdigest()
+
+    def _parse_soup(self, content):
+        """
+        Parse the main page using a BeautifulSoup document tree.
+        """
+        soup = self._get_soup(content)
+        page = _StatusPage()
+
+        # Find all names
+        page.residents = [x.nobr.b.text for x in soup.find_all(
+            ["th", "a"], title=RE_RESIDENTS)]
+
+        # Grap the list name
+        page.accountname = soup.find(["head", "title"]).text.replace(
+            "Eetlijst.nl - ", "", 1).strip()
+
+        # Find the main table by first navigating to a unique cell.
+        start = soup.find(["table", "tbody", "tr", "th"], width="80")
+        if not start:
+            raise ScrapingError("Cannot parse status table")
+
+        for row in start.parent.parent.find_all("tr"):
+            page_row = _StatusPageRow()
+            page_row.header = len(row.find_all("th")) > 0
+            page_row.deadline = bool(
+                row.find(["td", "a"], href=RE_JAVASCRIPT_VS_1))
+            page_row.markup = str(row.renderContents())
+            page_row.cells = [(str(cell.renderContents()), cell.text)
+                              for cell in row.find_all("td")]
+            page.rows.append(page_row)
 
-        return results
+        return page
 
     def _get_session(self, is_retry=False, renew=True):
         # Start a session
@@ -218,7 +516,8 @@ class EetlijstApi:
             "login": self.username,
             "pass": self.password
         }
-        response = requests.get(BASE_URL + "login.php", params=payload)
+        response = self._transport.get(
+            BASE_URL + "login.php", params=payload, timeout=TIMEOUT_REQUEST)
 
         # Check for errors
         if response.status_code != 200:
@@ -240,22 +539,31 @@ class EetlijstApi:
             raise ScrapingError("Unable to strip session id from URL")
 
         # Login redirects to main page, so cache it
-        self.cache["main_page"] = (response.content.decode(
-            response.encoding), self._timeout(seconds=TIMEOUT_CACHE))
+        self.cache.set("main_page", response.content.decode(response.encoding))
 
     def _main_page(self, is_retry=False, data=None):
         if data is None:
             data = {}
 
-        # Check if in cache
-        response = self._from_cache("main_page")
+        # Check if in cache, changes are always submitted
+        response = self._from_cache("main_page") if not data else None
+        if response is None:
+            session_id = self._get_session()
+
+            # A new login redirects to the main page, which is cached then
+            if not data:
+                response = self._from_cache("main_page")
+
         if response is None:  # not in cache, so get it from website
             payload = {
-                "session_id": self._get_session()
+                "session_id": session_id
             }
             payload.update(data)
 
-            response = requests.get(BASE_URL + "main.php", params=payload)
+            start = time.perf_counter()
+            response = self._transport.get(
+                BASE_URL + "main.php", params=payload, timeout=TIMEOUT_REQUEST)
+            profile_record('eetlijst.fetch', time.perf_counter() - start, len(response.content))
             # Check for errors
             if response.status_code != 200:
                 raise SessionError(
@@ -277,27 +585,26 @@ class EetlijstApi:
         # Update cache and session
         self.session = (self.session[0], self._timeout(
             seconds=TIMEOUT_SESSION))
-        self.cache["main_page"] = (
-            response, self._timeout(seconds=TIMEOUT_CACHE))
+        self.cache.set("main_page", response)
 
         return response
 
     def _from_cache(self, key):
-        try:
-            response, valid_until = self.cache[key]
-        except KeyError:
-            return None
-        return response if self._now() < valid_until else None
+        return self.cache.get(key)
 
     def _clear_cache(self):
         """
         Clear the internal cache and reset session.
         """
         self.session = None
-        self.cache = {}
+        self.cache.clear()
 
     def _get_soup(self, content):
-        return BeautifulSoup(content, "html.parser")
+        global _BEAUTIFUL_SOUP
+        if _BEAUTIFUL_SOUP is None:
+            from bs4 import BeautifulSoup
+            _BEAUTIFUL_SOUP = BeautifulSoup
+        return _BEAUTIFUL_SOUP(content, "html.parser")
 
     def _now(self):
         """
@@ -311,10 +618,176 @@ class EetlijstApi:
         """
         return self._now() + timedelta(seconds=seconds)
 
-    @Throttle(MIN_TIME_BETWEEN_UPDATES)
+    def snapshot(self):
+        """
+        Return the session and the last statuses as JSON serializable dict.
+        """
+        with self._lock:
+            session = None
+            if self.session is not None:
+                session = [self.session[0], int(self.session[1].timestamp())]
+
+            return {
+                "session": session,
+                "accountname": self.accountname,
+                "residents": self.residents,
+                "statuses": [{
+                    "timestamp": int(row.timestamp.timestamp()),
+                    "deadline": int(row.deadline.timestamp()) if row.deadline else None,
+                    "statuses": row.statuses,
+                } for row in self.statuses or []],
+            }
+
+    def restore(self, snapshot):
+        """
+        Restore the session, if still valid, and the statuses of a snapshot.
+        Return True if the list is known afterwards.
+        """
+        if not snapshot or not snapshot.get("residents"):
+            return False
+
+        try:
+            statuses = [StatusRow(
+                timestamp=datetime.fromtimestamp(row["timestamp"], tz=TZ_UTC),
+                deadline=datetime.fromtimestamp(row["deadline"], tz=TZ_UTC)
+                if row["deadline"] is not None else None,
+                statuses=row["statuses"]) for row in snapshot["statuses"]]
+            session = snapshot["session"]
+            accountname = snapshot["accountname"]
+            residents = snapshot["residents"]
+        except (KeyError, TypeError, ValueError) as e:
+            _LOGGER.warning("Cannot restore Eetlijst snapshot ({})".format(e))
+            return False
+
+        with self._lock:
+            if session is not None:
+                valid_until = datetime.fromtimestamp(session[1], tz=TZ_UTC)
+                if self._now() < valid_until:
+                    self.session = (session[0], valid_until)
+
+            self.accountname = accountname
+            self.residents = residents
+            self.statuses = statuses
+            self._update_states(statuses)
+
+        return True
+
+    def subscribe(self, callback):
+        """
+        Register a callback that is called with a list of status changes.
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def _update_states(self, statuses):
+        """
+        Compute the state and attributes of each resident and notify the
+        subscribers of statuses that changed since the previous update.
+        """
+        states = {}
+        snapshot = {}
+
+        for resident in self.residents or []:
+            days = []
+            for row in statuses:
+                if resident not in row.statuses:
+                    continue
+                date = row.timestamp.astimezone(TZ_EETLIJST).date().isoformat()
+                status = row.statuses[resident]
+                snapshot[(date, resident)] = status
+                days.append({
+                    ATTR_DATE: date,
+                    ATTR_STATUS: status_text(status),
+                    ATTR_DEADLINE: row.deadline.isoformat() if row.deadline else None,
+                })
+
+            if not days:
+                states[resident] = (None, {})
+                continue
+
+            today = days[0]
+            states[resident] = (today[ATTR_STATUS], {
+                ATTR_DEADLINE: today[ATTR_DEADLINE],
+                ATTR_UPCOMING: days[1:],
+            })
+
+        changes = []
+        if self._snapshot is not None:
+            for (date, resident), status in snapshot.items():
+                if (date, resident) not in self._snapshot:
+                    continue
+                old_status = self._snapshot[(date, resident)]
+                if old_status != status:
+                    changes.append({
+                        ATTR_LIST: self.accountname,
+                        ATTR_RESIDENT: resident,
+                        ATTR_DATE: date,
+                        ATTR_OLD_STATUS: status_text(old_status),
+                        ATTR_NEW_STATUS: status_text(status),
+                    })
+
+        self.states = states
+        self._snapshot = snapshot
+
+        if changes:
+            for callback in self._subscribers:
+                callback(changes)
+
+    def set_status(self, resident, value, date=None):
+        """
+        Set the dinner status of a resident for a date, today if not given.
+        The known statuses are changed right away, the page returned by the
+        server is parsed on the next update.
+        """
+        with self._lock:
+            if not self.statuses or resident not in self.residents:
+                raise Error("Unknown resident {}".format(resident))
+
+            for index, row in enumerate(self.statuses):
+                if date is None or \
+                        row.timestamp.astimezone(TZ_EETLIJST).date() == date:
+                    break
+            else:
+                raise Error("Unknown date {}".format(date))
+
+            self._main_page(data={
+                "day": int(row.timestamp.timestamp()),
+                "who": self.residents.index(resident),
+                "what": value,
+            })
+
+            statuses = dict(row.statuses)
+            statuses[resident] = value
+            self.statuses = list(self.statuses)
+            self.statuses[index] = StatusRow(
+                timestamp=row.timestamp,
+                deadline=row.deadline,
+                statuses=statuses)
+            self._update_states(self.statuses)
+
     def update(self):
         """Update function for updating api information."""
-        self.statuses = self.get_statuses()
+        with self._lock:
+            statuses = self.get_statuses()
+            self.statuses = statuses
+            self._update_states(statuses)
+
+
+def status_text(status):
+    """
+    Return the text of a dinner status.
+    """
+    if status is None:
+        return "?"
+    elif status == 0:
+        return "No dinner"
+    elif status == 1:
+        return "Cook"
+    elif status == -1:
+        return "Dinner"
+    elif status > 1:
+        return "Cook + %d" % (status - 1)
+    return "Dinner + %d" % (-1 * status - 1)
 
 
 class StatusRow(object):
@@ -332,6 +805,198 @@ class StatusRow(object):
         return "StatusRow(timestamp={}, deadline={}, statuses={})".format(self.timestamp, self.deadline, self.statuses)
 
 
+class _StatusPage(object):
+    """
+    Residents, list name and status table rows of the main page.
+    """
+
+    def __init__(self):
+        self.residents = []
+        self.accountname = None
+        self.rows = []
+
+
+class _StatusPageRow(object):
+    """
+    Row of the status table: whether it is a header row, whether it links to
+    a deadline, its markup and the (markup, text) of each cell.
+    """
+
+    def __init__(self):
+        self.header = False
+        self.deadline = False
+        self.markup = ""
+        self.cells = []
+
+
+class _StatusPageParser(HTMLParser):
+    """
+    Single pass parser of the main page. Instead of building a document tree,
+    only the open element names are tracked and the residents, list name and
+    status table are collected while the page is tokenized.
+    """
+
+    # Elements without content and end tag
+    VOID_ELEMENTS = frozenset([
+        "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+        "meta", "param", "source", "track", "wbr", "basefont", "bgsound",
+        "frame", "keygen", "spacer"])
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.page = _StatusPage()
+
+        self._stack = []
+
+        # Depth and text parts of the first head or title element
+        self._title = None
+
+        # Resident elements: [depth, nobr depth, b depth, b closed, text parts]
+        self._residents = []
+
+        # Depth of the element containing the status table rows
+        self._table = None
+        self._table_closed = False
+
+        self._row = None
+        self._row_depth = None
+        self._row_markup = None
+        self._cell = None
+        self._cell_depth = None
+
+    def iter_rows(self, content):
+        """
+        Feed the content in chunks and yield each status table row as soon as
+        it is complete.
+        """
+        for start in range(0, len(content), PARSE_CHUNK_SIZE):
+            self.feed(content[start:start + PARSE_CHUNK_SIZE])
+            yield from self._take_rows()
+
+        self.close()
+        yield from self._take_rows()
+
+        if self._table is None:
+            raise ScrapingError("Cannot parse status table")
+
+    def _take_rows(self):
+        rows = self.page.rows
+        self.page.rows = []
+        return rows
+
+    def close(self):
+        super().close()
+
+        # Close all elements that are still open
+        while self._stack:
+            self._end(len(self._stack) - 1)
+            self._stack.pop()
+
+    def handle_starttag(self, tag, attrs):
+        depth = len(self._stack)
+        attrs = dict(attrs)
+        markup = self.get_starttag_text()
+
+        # List name
+        if self._title is None and tag in ("head", "title"):
+            self._title = [depth, []]
+
+        # Residents, the text of the first b in the first nobr
+        for resident in self._residents:
+            if resident[3]:
+                continue
+            if tag == "nobr" and resident[1] is None:
+                resident[1] = depth
+            elif tag == "b" and resident[1] is not None and resident[2] is None:
+                resident[2] = depth
+        if tag in ("th", "a") and RE_RESIDENTS.search(attrs.get("title") or ""):
+            self._residents.append([depth, None, None, False, []])
+
+        # Status table, starting at the parent of the row with the unique cell
+        if self._table is None and tag in ("table", "tbody", "tr", "th") and \
+                attrs.get("width") == "80":
+            if depth < 2:
+                raise ScrapingError("Cannot parse status table")
+            self._table = depth - 2
+
+        if self._table is not None and not self._table_closed:
+            if self._row is None:
+                if tag == "tr":
+                    self._row = _StatusPageRow()
+                    self._row_depth = depth
+                    self._row_markup = []
+            else:
+                self._row_markup.append(markup)
+                if tag == "th":
+                    self._row.header = True
+                elif tag in ("td", "a") and RE_JAVASCRIPT_VS_1.search(attrs.get("href") or ""):
+                    self._row.deadline = True
+
+                if self._cell is None:
+                    if tag == "td":
+                        self._cell = ([], [])
+                        self._cell_depth = depth
+                else:
+                    self._cell[0].append(markup)
+
+        if tag not in self.VOID_ELEMENTS:
+            self._stack.append(tag)
+
+    def handle_endtag(self, tag):
+        # Close up to the last open element with this name, like the tree
+        # builder does. End tags without open element are ignored.
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index] == tag:
+                while len(self._stack) > index:
+                    self._end(len(self._stack) - 1)
+                    self._stack.pop()
+                break
+
+    def handle_data(self, data):
+        if self._title is not None and self.page.accountname is None and \
+                (not self._stack or self._stack[-1] not in ("script", "style")):
+            self._title[1].append(data)
+
+        for resident in self._residents:
+            if resident[2] is not None and not resident[3]:
+                resident[4].append(data)
+
+        if self._row is not None:
+            self._row_markup.append(data)
+            if self._cell is not None:
+                self._cell[0].append(data)
+                self._cell[1].append(data)
+
+    def _end(self, depth):
+        """Handle the end of the element at depth."""
+        if self._title is not None and self._title[0] == depth and \
+                self.page.accountname is None:
+            self.page.accountname = "".join(self._title[1]).replace(
+                "Eetlijst.nl - ", "", 1).strip()
+
+        for resident in self._residents:
+            if resident[3]:
+                continue
+            if resident[2] == depth:
+                resident[3] = True
+                self.page.residents.append("".join(resident[4]))
+            elif resident[2] is None and depth in (resident[0], resident[1]):
+                # The resident element or its first nobr has no b
+                raise ScrapingError("Cannot parse resident name")
+
+        if self._cell is not None and self._cell_depth == depth:
+            self._row.cells.append(("".join(self._cell[0]), "".join(self._cell[1])))
+            self._cell = None
+
+        if self._row is not None and self._row_depth == depth:
+            self._row.markup = "".join(self._row_markup)
+            self.page.rows.append(self._row)
+            self._row = None
+
+        if self._table == depth:
+            self._table_closed = True
+
+
 class EetlijstSensor(Entity):
     """Representation of a Eetlijst Sensor."""
 
@@ -357,40 +1022,31 @@ class EetlijstSensor(Entity):
     @property
     def state(self):
         """Return the state of the sensor."""
-
-        # get status of today
-        status = self._api.statuses[0].statuses[self.resident]
-        if status is None:
-            value = "?"
-        elif status == 0:
-            value = "No dinner"
-        elif status == 1:
-            value = "Cook"
-        elif status == -1:
-            value = "Dinner"
-        elif status > 1:
-            value = "Cook + %d" % (status - 1)
-        elif status < -1:
-            value = "Dinner + %d" % (-1 * status - 1)
-        return value
+        state = self._api.states.get(self.resident)
+        return state[0] if state else None
 
     @property
     def unit_of_measurement(self):
         """Return the unit the value is expressed in."""
         return self.var_units
 
-    def update(self):
-        """Get the latest data for the states."""
-        if self._api is not None:
-            self._api.update()
+    @property
+    def should_poll(self):
+        """Return False, the coordinator pushes new states."""
+        return False
 
     @property
     def device_state_attributes(self):
         """Return the state attributes."""
-        return {
+        attributes = {
             ATTR_ATTRIBUTION: CONF_ATTRIBUTION,
         }
 
+        state = self._api.states.get(self.resident)
+        if state:
+            attributes.update(state[1])
+        return attributes
+
 
 class Error(Exception):
     """
@@ -4,32 +4,69 @@ Support for Luftdaten sensors.
 For more details about this platform, please refer to the documentation at
 https://github.com/Sanderhuisman/home-assistant-custom-components
 """
+import asyncio
+import codecs
+import json
 import logging
+import math
+import random
+import time
+from collections import deque
 from datetime import timedelta
 
+import aiohttp
+import async_timeout
 import homeassistant.helpers.config_validation as cv
-import requests
+import homeassistant.util.dt as dt_util
 import voluptuous as vol
 from homeassistant.components.sensor import PLATFORM_SCHEMA
 from homeassistant.const import (
     ATTR_ATTRIBUTION,
     ATTR_LATITUDE,
     ATTR_LONGITUDE,
+    CONF_HOST,
+    CONF_LATITUDE,
+    CONF_LONGITUDE,
     CONF_MONITORED_CONDITIONS,
     CONF_NAME,
+    CONF_RADIUS,
     CONF_SHOW_ON_MAP,
+    EVENT_HOMEASSISTANT_STOP,
     TEMP_CELSIUS
 )
+from homeassistant.exceptions import PlatformNotReady
 from homeassistant.helpers.entity import Entity
-from homeassistant.util import Throttle
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import STORAGE_DIR, Store
+from homeassistant.util import location
+from homeassistant.util.json import load_json, save_json
+
+from custom_components.http_fetch import async_get_fetcher, profile_record
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 VERSION = '0.0.3'
 
+REQUIREMENTS = ['numpy==1.16.2']
+
 _LOGGER = logging.getLogger(__name__)
 
 BASE_URL = 'https://api.luftdaten.info/v1'
+BULK_URL = 'https://api.luftdaten.info/static/v1/data.json'
 
+DATA_LUFTDATEN = 'luftdaten_cu'
+
+# The bulk dataset contains all stations, so only use it for several stations
+BULK_MIN_STATIONS = 5
+BULK_CHUNK_SIZE = 64 * 1024
+
+ATTR_AGE = 'age'
 ATTR_SENSOR_ID = 'sensor_id'
+ATTR_STATIONS = 'stations'
+ATTR_OUTLIERS = 'outliers'
 
 CONF_ATTRIBUTION = "Data provided by luftdaten.info"
 
@@ -40,6 +77,10 @@ SENSOR_HUMIDITY = 'humidity'
 SENSOR_PM10 = 'P1'
 SENSOR_PM2_5 = 'P2'
 SENSOR_PRESSURE = 'pressure'
+SENSOR_PM10_1H = 'P1_1h'
+SENSOR_PM10_24H = 'P1_24h'
+SENSOR_PM2_5_1H = 'P2_1h'
+SENSOR_PM2_5_24H = 'P2_24h'
 
 SENSOR_TYPES = {
     SENSOR_TEMPERATURE: ['Temperature', TEMP_CELSIUS, 'mdi:thermometer'],
@@ -47,50 +88,543 @@ SENSOR_TYPES = {
     SENSOR_PRESSURE: ['Pressure', 'Pa', 'mdi:arrow-down-bold'],
     SENSOR_PM10: ['PM10', VOLUME_MICROGRAMS_PER_CUBIC_METER, 'mdi:thought-bubble'],
     SENSOR_PM2_5: ['PM2.5', VOLUME_MICROGRAMS_PER_CUBIC_METER,
-                   'mdi:thought-bubble-outline']
+                   'mdi:thought-bubble-outline'],
+    SENSOR_PM10_1H: ['PM10 (1h)', VOLUME_MICROGRAMS_PER_CUBIC_METER, 'mdi:thought-bubble'],
+    SENSOR_PM10_24H: ['PM10 (24h)', VOLUME_MICROGRAMS_PER_CUBIC_METER, 'mdi:thought-bubble'],
+    SENSOR_PM2_5_1H: ['PM2.5 (1h)', VOLUME_MICROGRAMS_PER_CUBIC_METER,
+                      'mdi:thought-bubble-outline'],
+    SENSOR_PM2_5_24H: ['PM2.5 (24h)', VOLUME_MICROGRAMS_PER_CUBIC_METER,
+                       'mdi:thought-bubble-outline'],
+}
+
+# Running means over the readings of a station: condition -> (value type, window)
+ROLLING_MEANS = {
+    SENSOR_PM10_1H: (SENSOR_PM10, timedelta(hours=1)),
+    SENSOR_PM10_24H: (SENSOR_PM10, timedelta(hours=24)),
+    SENSOR_PM2_5_1H: (SENSOR_PM2_5, timedelta(hours=1)),
+    SENSOR_PM2_5_24H: (SENSOR_PM2_5, timedelta(hours=24)),
+}
+
+# Enough for 24 hours of readings of a local device polled every 10 seconds
+ROLLING_MAX_READINGS = 10000
+
+LOCAL_URL = 'http://{}/data.json'
+LOCAL_MIN_TIME_BETWEEN_UPDATES = timedelta(seconds=5)
+
+# Value types of the device firmware for the conditions
+LOCAL_VALUE_TYPES = {
+    'SDS_P1': SENSOR_PM10,
+    'SDS_P2': SENSOR_PM2_5,
+    'PMS_P1': SENSOR_PM10,
+    'PMS_P2': SENSOR_PM2_5,
+    'HPM_P1': SENSOR_PM10,
+    'HPM_P2': SENSOR_PM2_5,
+    'temperature': SENSOR_TEMPERATURE,
+    'humidity': SENSOR_HUMIDITY,
+    'BME280_temperature': SENSOR_TEMPERATURE,
+    'BME280_humidity': SENSOR_HUMIDITY,
+    'BME280_pressure': SENSOR_PRESSURE,
+    'BMP_temperature': SENSOR_TEMPERATURE,
+    'BMP_pressure': SENSOR_PRESSURE,
+    'BMP280_temperature': SENSOR_TEMPERATURE,
+    'BMP280_pressure': SENSOR_PRESSURE,
+    'HTU21D_temperature': SENSOR_TEMPERATURE,
+    'HTU21D_humidity': SENSOR_HUMIDITY,
+    'SHT3X_temperature': SENSOR_TEMPERATURE,
+    'SHT3X_humidity': SENSOR_HUMIDITY,
 }
 
 DEFAULT_NAME = 'Luftdaten'
 
 CONF_SENSORID = 'sensorid'
+CONF_SENSORIDS = 'sensorids'
+CONF_STATIONS = 'stations'
+CONF_AGGREGATE = 'aggregate'
+
+AGGREGATE_MEDIAN = 'median'
+AGGREGATE_TRIMMED_MEAN = 'trimmed_mean'
+
+DEFAULT_STATIONS = 1
+
+# Readings further than this from the median absolute deviation are outliers
+OUTLIER_THRESHOLD = 3.0
+MAD_SCALE = 1.4826
+TRIM_FRACTION = 0.1
+
+# Weight of a station halves at the radius (or the farthest station, at least the
+# min distance scale) and every freshness scale, readings older than the max age
+# are ignored
+MIN_DISTANCE_SCALE = 1.0  # km
+FRESHNESS_SCALE = 600.0  # seconds
+FRESHNESS_MAX_AGE = 3600.0  # seconds
 
 MIN_TIME_BETWEEN_UPDATES = timedelta(minutes=5)
 
-PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
-    vol.Required(CONF_SENSORID): cv.positive_int,
+TIMEOUT = 10
+BULK_TIMEOUT = 120
+
+# Retry failed updates after an exponential backoff with jitter (seconds)
+BACKOFF_BASE = 30
+BACKOFF_MAX = 30 * 60
+
+# Delay to fetch newly registered stations together
+REGISTER_DELAY = 1
+
+STORAGE_VERSION = 1
+STORAGE_KEY = 'luftdaten_cu.readings'
+
+# Station locations are indexed in a grid of cells of 0.1 degree
+INDEX_FILE = 'luftdaten_cu.stations'
+INDEX_MAX_AGE = timedelta(days=1)
+INDEX_CELL_SIZE = 0.1
+
+KM_PER_DEGREE = 111.2
+
+PLATFORM_SCHEMA = vol.All(PLATFORM_SCHEMA.extend({
+    vol.Optional(CONF_SENSORID): cv.positive_int,
+    vol.Optional(CONF_HOST): cv.string,
+    vol.Optional(CONF_SENSORIDS): vol.All(cv.ensure_list, [cv.positive_int]),
+    vol.Optional(CONF_AGGREGATE): vol.In([AGGREGATE_MEDIAN, AGGREGATE_TRIMMED_MEAN]),
+    vol.Optional(CONF_RADIUS): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Inclusive(CONF_LATITUDE, 'coordinates'): cv.latitude,
+    vol.Inclusive(CONF_LONGITUDE, 'coordinates'): cv.longitude,
+    vol.Optional(CONF_STATIONS, default=DEFAULT_STATIONS): cv.positive_int,
     vol.Required(CONF_MONITORED_CONDITIONS):
         vol.All(cv.ensure_list, [vol.In(SENSOR_TYPES)]),
     vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
-})
+}), cv.has_at_least_one_key(CONF_SENSORID, CONF_SENSORIDS, CONF_RADIUS, CONF_HOST))
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the Luftdaten sensor."""
-    sensor_id = config.get(CONF_SENSORID)
+    if np is None:
+        _LOGGER.error("Missing numpy library, cannot set up Luftdaten sensor")
+        return
+
     monitored_conditions = config.get(CONF_MONITORED_CONDITIONS)
 
-    try:
-        api = LuftdatenApi(sensor_id)
-    except Exception as e:
-        _LOGGER.error("Could not setup Lufdaten sensor ({})".format(e))
-        return False
+    # All platform entries share one registry, such that all stations are
+    # fetched together and a station configured twice is fetched once.
+    registry = hass.data.get(DATA_LUFTDATEN)
+    if registry is None:
+        registry = hass.data[DATA_LUFTDATEN] = LuftdatenRegistry(
+            hass, async_get_fetcher(hass))
+
+    if CONF_HOST in config:
+        return await _async_setup_local(hass, config, registry, async_add_entities)
+
+    latitude = config.get(CONF_LATITUDE, hass.config.latitude)
+    longitude = config.get(CONF_LONGITUDE, hass.config.longitude)
+
+    # Sensor ids per monitored condition
+    stations = {}
+    if CONF_SENSORID in config or CONF_SENSORIDS in config:
+        sensor_ids = config.get(CONF_SENSORIDS, [])
+        if CONF_SENSORID in config:
+            sensor_ids = [config[CONF_SENSORID]] + sensor_ids
+        for variable in monitored_conditions:
+            stations[variable] = sensor_ids
     else:
-        if api.data is None:
-            _LOGGER.error("Sensor is not available: {}".format(sensor_id))
-            return
-
-        sensors = [LuftdatenSensor(api, variable)
-                   for variable in monitored_conditions
-                   if variable in SENSOR_TYPES and variable in api.data]
+        try:
+            index = await registry.async_get_index()
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+            # Only without any index, the setup is retried later
+            _LOGGER.warning("Could not find Luftdaten stations ({})".format(e))
+            raise PlatformNotReady
+
+        for variable in monitored_conditions:
+            value_type = ROLLING_MEANS[variable][0] if variable in ROLLING_MEANS else variable
+            stations[variable] = index.nearest(
+                latitude, longitude, config[CONF_RADIUS], value_type, config[CONF_STATIONS])
+            if not stations[variable]:
+                _LOGGER.warning("No station found for {} within {} km".format(
+                    variable, config[CONF_RADIUS]))
+
+    # Stations are fetched in the background, entities start from the last reading
+    apis = {}
+    for sensor_id in set(sum(stations.values(), [])):
+        apis[sensor_id] = await registry.async_register(sensor_id)
+
+    sensors = []
+    for variable, sensor_ids in stations.items():
+        variable_apis = [apis[sensor_id] for sensor_id in sensor_ids]
+        if CONF_AGGREGATE in config:
+            # One virtual sensor combining all stations
+            if variable_apis:
+                sensors.append(LuftdatenAggregateSensor(
+                    variable_apis, variable, config[CONF_AGGREGATE],
+                    config[CONF_NAME], latitude, longitude, config.get(CONF_RADIUS)))
+        else:
+            sensors += [LuftdatenSensor(api, variable) for api in variable_apis]
+
+    if not sensors:
+        return False
 
-        add_entities(sensors, True)
+    async_add_entities(sensors, True)
+
+    return True
+
+
+async def _async_setup_local(hass, config, registry, async_add_entities):
+    """Set up a device polled on the local network, with the cloud as fallback."""
+    fallback = None
+    if CONF_SENSORID in config:
+        fallback = await registry.async_register(config[CONF_SENSORID])
+
+    api = LuftdatenLocalApi(async_get_fetcher(hass), config[CONF_HOST], fallback)
+
+    sensors = [LuftdatenSensor(api, variable)
+               for variable in config[CONF_MONITORED_CONDITIONS]
+               if variable in SENSOR_TYPES]
+
+    async_add_entities(sensors, True)
+
+    return True
+
+
+class _JsonArrayParser:
+    """Incrementally decode the objects of a top level JSON array."""
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+
+    def feed(self, chunk):
+        """Return the objects completed by this chunk."""
+        buffer = self._buffer + self._text.decode(chunk)
+        objects = []
+        index = 0
+        while True:
+            # Skip the array brackets, separators and whitespace
+            while index < len(buffer) and buffer[index] in '[], \t\r\n':
+                index += 1
+            if index == len(buffer):
+                break
+
+            try:
+                obj, index = self._decoder.raw_decode(buffer, index)
+            except ValueError:
+                # Object is not complete yet
+                break
+            objects.append(obj)
+
+        # Only the incomplete object is kept
+        self._buffer = buffer[index:]
+        return objects
+
+
+class LuftdatenStationIndex:
+    """Grid buckets of station locations to find the nearest stations."""
+
+    def __init__(self, timestamp, stations):
+        self.timestamp = timestamp
+        self._stations = stations  # [sensor id, latitude, longitude, value types]
+        self._cells = {}
+        for station in stations:
+            self._cells.setdefault(
+                self._cell(station[1], station[2]), []).append(station)
+
+    @staticmethod
+    def _cell(latitude, longitude):
+        return (int(math.floor(latitude / INDEX_CELL_SIZE)),
+                int(math.floor(longitude / INDEX_CELL_SIZE)))
+
+    @staticmethod
+    def collect(stations, entries):
+        """Collect the stations of entries of the bulk dataset."""
+        for entry in entries:
+            try:
+                # Only outdoor stations that have a valid reading
+                if entry['location'].get('indoor'):
+                    continue
+                latitude = float(entry['location']['latitude'])
+                longitude = float(entry['location']['longitude'])
+                value_types = set()
+                for value in entry['sensordatavalues']:
+                    float(value['value'])
+                    value_types.add(value['value_type'])
+                sensor_id = entry['sensor']['id']
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            station = stations.get(sensor_id)
+            if station is None:
+                stations[sensor_id] = [sensor_id, latitude, longitude, value_types]
+            else:
+                station[3] |= value_types
+
+    @classmethod
+    def from_stations(cls, stations):
+        """Build the index from the collected stations."""
+        return cls(
+            dt_util.utcnow().timestamp(),
+            [[sensor_id, latitude, longitude, sorted(value_types & set(SENSOR_TYPES))]
+             for sensor_id, latitude, longitude, value_types in stations.values()])
+
+    def as_dict(self):
+        return {
+            'timestamp': self.timestamp,
+            'stations': self._stations,
+        }
 
-        return True
+    def is_expired(self):
+        return dt_util.utcnow().timestamp() - self.timestamp > INDEX_MAX_AGE.total_seconds()
+
+    def nearest(self, latitude, longitude, radius, value_type, count):
+        """Return the sensor ids of the nearest stations within radius (km)."""
+        delta_latitude = radius / KM_PER_DEGREE
+        delta_longitude = radius / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+        cell_min = self._cell(latitude - delta_latitude, longitude - delta_longitude)
+        cell_max = self._cell(latitude + delta_latitude, longitude + delta_longitude)
+
+        candidates = []
+        for row in range(cell_min[0], cell_max[0] + 1):
+            for column in range(cell_min[1], cell_max[1] + 1):
+                for sensor_id, lat, lon, value_types in self._cells.get((row, column), []):
+                    if value_type not in value_types:
+                        continue
+                    distance = location.distance(latitude, longitude, lat, lon) / 1000
+                    if distance <= radius:
+                        candidates.append((distance, sensor_id))
+
+        candidates.sort()
+        return [sensor_id for _, sensor_id in candidates[:count]]
+
+
+class LuftdatenRegistry:
+    """Fetch the data of all registered stations at once."""
+
+    def __init__(self, hass, fetcher):
+        self._hass = hass
+        self._fetcher = fetcher
+        self._lock = asyncio.Lock()
+        self._refresh_lock = asyncio.Lock()
+        self._stations = {}
+
+        # Last reading per station, to start from after a restart
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._readings = None
+
+        self._failures = 0
+        self._unsub_refresh = None
+        self._refresh_at = None
+        self._stopped = False
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self._async_stop)
+
+        # ETag and Last-Modified per URL for conditional requests
+        self._validators = {}
+
+        self._index = None
+        self._index_lock = asyncio.Lock()
+        self._index_task = None
+
+    async def async_register(self, sensor_id):
+        """Return the station restored from its last reading, without fetching it."""
+        async with self._lock:
+            if self._readings is None:
+                self._readings = await self._store.async_load() or {}
+
+            api = self._stations.get(sensor_id)
+            if api is None:
+                api = LuftdatenApi(self, sensor_id)
+                reading = self._readings.get(str(sensor_id))
+                if reading is not None:
+                    api.restore(reading)
+                self._stations[sensor_id] = api
+
+                # Fetch the new stations together in the background
+                self._schedule_refresh(REGISTER_DELAY)
+        return api
+
+    def _schedule_refresh(self, delay):
+        """Refresh after delay seconds, unless a refresh is scheduled earlier already."""
+        if self._stopped:
+            return
+        refresh_at = time.monotonic() + delay
+        if self._unsub_refresh is not None:
+            if self._refresh_at <= refresh_at:
+                return
+            self._unsub_refresh()
+        self._refresh_at = refresh_at
+        self._unsub_refresh = async_call_later(self._hass, delay, self._async_refresh)
+
+    async def _async_stop(self, event):
+        self._stopped = True
+        if self._unsub_refresh is not None:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+
+    async def _async_refresh(self, now=None):
+        """Update all stations, with one request for many stations."""
+        self._unsub_refresh = None
+        delay = MIN_TIME_BETWEEN_UPDATES.total_seconds()
+        try:
+            async with self._refresh_lock:
+                # Fetched without the lock, such that registering does not wait
+                async with self._lock:
+                    stations = dict(self._stations)
+
+                if len(stations) >= BULK_MIN_STATIONS:
+                    requests = 1
+                    errors = await self._async_get_bulk(stations)
+                else:
+                    requests = len(stations)
+                    errors = []
+                    for api in stations.values():
+                        errors += await self._async_get_station(api)
+
+                # Only back off when no request succeeded
+                if requests and len(errors) == requests:
+                    self._failures += 1
+                    # Full jitter, such that retries of several instances spread out
+                    delay = random.uniform(
+                        0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** self._failures))
+                    _LOGGER.error("Cannot update Luftdaten data, retry in {:.0f} seconds ({})".format(
+                        delay, errors[-1]))
+                    return
+
+                self._failures = 0
+                for sensor_id, api in stations.items():
+                    if api.timestamp is not None:
+                        self._readings[str(sensor_id)] = api.snapshot()
+                await self._store.async_save(self._readings)
+        finally:
+            self._schedule_refresh(delay)
+
+    async def async_get_index(self):
+        """Return the station index.
+
+        The index is loaded from disk and only waited for when there is none
+        yet. An index older than a day is used while it is rebuilt in the
+        background, stations are picked at setup so it is not rebuilt
+        periodically.
+        """
+        async with self._index_lock:
+            if self._index is None:
+                data = await self._hass.async_add_executor_job(
+                    load_json, self._hass.config.path(STORAGE_DIR, INDEX_FILE), {})
+                if data:
+                    self._index = LuftdatenStationIndex(data['timestamp'], data['stations'])
+
+            if self._index is None:
+                await self._async_build_index()
+            elif self._index.is_expired() and self._index_task is None:
+                self._index_task = self._hass.async_create_task(self._async_rebuild_index())
+
+        return self._index
+
+    async def _async_rebuild_index(self):
+        try:
+            async with self._index_lock:
+                await self._async_build_index()
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+            _LOGGER.error("Cannot rebuild Luftdaten station index, the previous one is used ({})".format(e))
+        finally:
+            self._index_task = None
+
+    async def _async_build_index(self):
+        path = self._hass.config.path(STORAGE_DIR, INDEX_FILE)
+        stations = {}
+        await self._async_fetch(
+            BULK_URL, lambda entries: LuftdatenStationIndex.collect(stations, entries),
+            conditional=False)
+
+        self._index = LuftdatenStationIndex.from_stations(stations)
+        await self._hass.async_add_executor_job(save_json, path, self._index.as_dict())
+        _LOGGER.info("Indexed {} Luftdaten stations".format(len(self._index.as_dict()['stations'])))
+
+    async def _async_fetch(self, url, handle=None, conditional=True):
+        """Return the decoded response, or None when it did not change.
+
+        With handle the response must be a JSON array, which is parsed while
+        it is received and of which the objects are passed to handle.
+        """
+        headers = {}
+        etag, last_modified = self._validators.get(url, (None, None))
+        if conditional and etag is not None:
+            headers['If-None-Match'] = etag
+        if conditional and last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+
+        start = time.perf_counter()
+        async with async_timeout.timeout(TIMEOUT if handle is None else BULK_TIMEOUT):
+            async with self._fetcher.request(url, headers=headers) as response:
+                _LOGGER.debug("Status code: {} for {}".format(
+                    response.status, url))
+                if response.status == 304:
+                    return None
+                response.raise_for_status()
+
+                # Only the caller that sends the validators may skip unchanged data
+                if conditional:
+                    self._validators[url] = (
+                        response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+                if handle is None:
+                    body = await response.read()
+                    profile_record('luftdaten.fetch', time.perf_counter() - start, len(body))
+                    return await response.json(content_type=None)
+
+                size = 0
+                parser = _JsonArrayParser()
+                async for chunk in response.content.iter_chunked(BULK_CHUNK_SIZE):
+                    size += len(chunk)
+                    handle(parser.feed(chunk))
+                profile_record('luftdaten.fetch_bulk', time.perf_counter() - start, size)
+                return True
+
+    async def _async_get_station(self, api):
+        """Update a station and return the errors of its request."""
+        url = BASE_URL + '/sensor/{}/'.format(api.sensor_id)
+        try:
+            data = await self._async_fetch(url)
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+            _LOGGER.warning("Cannot update Luftdaten station {} ({})".format(api.sensor_id, e))
+            return [e]
+
+        if data is not None:
+            self._set_measurements(api, data)
+        return []
+
+    async def _async_get_bulk(self, stations):
+        """Update the stations from the bulk data and return the errors of its request."""
+        measurements = {}
+
+        def handle(entries):
+            # Only the entries of the registered stations are kept
+            for entry in entries:
+                sensor_id = entry.get('sensor', {}).get('id')
+                if sensor_id in stations:
+                    measurements.setdefault(sensor_id, []).append(entry)
+
+        try:
+            if await self._async_fetch(BULK_URL, handle) is None:
+                return []
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+            return [e]
+
+        for sensor_id, api in stations.items():
+            if sensor_id in measurements:
+                self._set_measurements(api, measurements[sensor_id])
+        return []
+
+    @staticmethod
+    def _set_measurements(api, data):
+        # A malformed reading of one station does not stop the others
+        try:
+            api.set_measurements(data)
+        except (KeyError, TypeError, ValueError) as e:
+            _LOGGER.warning("Invalid data of Luftdaten station {} ({})".format(api.sensor_id, e))
 
 
 class LuftdatenApi:
-    def __init__(self, sensor_id):
+    def __init__(self, registry, sensor_id):
+        self._registry = registry
         self.sensor_id = sensor_id
+        self.latitude = None
+        self.longitude = None
+        self.timestamp = None
         self.data = {
             'humidity': None,
             'P1': None,
@@ -99,31 +633,153 @@ class LuftdatenApi:
             'temperature': None,
         }
 
-        self._get_data()
+        self._rolling = {
+            condition: RollingMean(window)
+            for condition, (_, window) in ROLLING_MEANS.items()}
+        for condition in self._rolling:
+            self.data[condition] = None
+
+    def set_measurements(self, data):
+        """Set the data from the measurements of the station."""
+        if data:
+            # Get last measurement
+            sensor_data = max(data, key=lambda timestamp: timestamp['timestamp'])
+
+            for entry in sensor_data['sensordatavalues']:
+                self.data[entry['value_type']] = float(entry['value'])
+
+            # Timestamps are in UTC
+            timestamp = dt_util.parse_datetime(sensor_data['timestamp'])
+            if timestamp is not None:
+                self.timestamp = timestamp.replace(tzinfo=dt_util.UTC)
+
+            self._add_readings(data)
+
+            try:
+                self.latitude = float(sensor_data['location']['latitude'])
+                self.longitude = float(sensor_data['location']['longitude'])
+            except (KeyError, TypeError, ValueError):
+                pass
+
+    def snapshot(self):
+        """Return the last reading in a JSON serializable form."""
+        return {
+            'timestamp': self.timestamp.isoformat(),
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'data': self.data,
+        }
 
-    def _get_data(self):
-        response = requests.get(
-            BASE_URL + '/sensor/{}/'.format(self.sensor_id))
-        _LOGGER.info("Status code: {} with text: {}".format(
-            response.status_code, response.text))
-        if response.status_code == 200:
-            data = response.json()
+    def restore(self, snapshot):
+        """Restore the last reading of a previous run."""
+        self.timestamp = dt_util.parse_datetime(snapshot['timestamp'])
+        self.latitude = snapshot.get('latitude')
+        self.longitude = snapshot.get('longitude')
+        self.data.update(snapshot.get('data') or {})
+
+    def _add_readings(self, data):
+        """Add all new readings of the measurement window to the running means."""
+        readings = {}
+        for measurement in data:
+            timestamp = dt_util.parse_datetime(measurement['timestamp'])
+            if timestamp is None:
+                continue
+            # Same reading is returned by several fetches, keep it once
+            readings[dt_util.as_timestamp(timestamp.replace(tzinfo=dt_util.UTC))] = measurement
+
+        for timestamp in sorted(readings):
+            values = {}
+            for entry in readings[timestamp]['sensordatavalues']:
+                try:
+                    values[entry['value_type']] = float(entry['value'])
+                except (KeyError, ValueError):
+                    continue
+
+            for condition, (value_type, _) in ROLLING_MEANS.items():
+                if value_type in values:
+                    self._rolling[condition].add(timestamp, values[value_type])
+
+        for condition, rolling in self._rolling.items():
+            self.data[condition] = rolling.mean
+
+    async def async_update(self):
+        """Update function for updating api information.
+
+        Stations are fetched in the background by the registry.
+        """
+
+
+class LuftdatenLocalApi(LuftdatenApi):
+    """Station read from the device on the local network."""
+
+    def __init__(self, fetcher, host, fallback=None):
+        super().__init__(None, fallback.sensor_id if fallback is not None else host)
+        self._fetcher = fetcher
+        self._host = host
+        self._fallback = fallback
+        self._last_data = None
+
+    async def async_update(self):
+        """Update function for updating api information."""
+        try:
+            async with async_timeout.timeout(TIMEOUT):
+                # All sensors of the device share one cached reading
+                data = await self._fetcher.async_get_json(
+                    LOCAL_URL.format(self._host),
+                    ttl=LOCAL_MIN_TIME_BETWEEN_UPDATES.total_seconds())
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+            if self._fallback is None:
+                _LOGGER.error("Cannot read device {} ({})".format(self._host, e))
+                return
 
-            if data is not None:
-                # Get last measurement
-                sensor_data = sorted(
-                    data, key=lambda timestamp: timestamp['timestamp'], reverse=True)[0]
+            _LOGGER.warning("Cannot read device {}, using cloud data ({})".format(self._host, e))
+            if self._fallback.timestamp is not None:
+                self.data = dict(self._fallback.data)
+                self.timestamp = self._fallback.timestamp
+            return
 
-                for entry in sensor_data['sensordatavalues']:
-                    self.data[entry['value_type']] = float(entry['value'])
-            else:
-                self.data = None
-                return
+        if data is self._last_data:
+            return
+        self._last_data = data
 
-    @Throttle(MIN_TIME_BETWEEN_UPDATES)
-    def update(self):
-        """Update function for updating api information."""
-        self._get_data()
+        values = []
+        for entry in data.get('sensordatavalues', []):
+            value_type = LOCAL_VALUE_TYPES.get(entry.get('value_type'))
+            if value_type is not None:
+                values.append({'value_type': value_type, 'value': entry['value']})
+
+        # Device readings are current, format them as a cloud measurement
+        self.set_measurements([{
+            'timestamp': dt_util.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'sensordatavalues': values,
+        }])
+
+
+class RollingMean:
+    """Mean over a time window, updated incrementally for every reading."""
+
+    def __init__(self, window):
+        self._window = window.total_seconds()
+        self._readings = deque()
+        self._sum = 0.0
+
+    def add(self, timestamp, value):
+        """Add a reading, readings older than the last one are ignored."""
+        if self._readings and timestamp <= self._readings[-1][0]:
+            return
+
+        self._readings.append((timestamp, value))
+        self._sum += value
+
+        while self._readings and (self._readings[0][0] <= timestamp - self._window or
+                                  len(self._readings) > ROLLING_MAX_READINGS):
+            self._sum -= self._readings.popleft()[1]
+
+    @property
+    def mean(self):
+        if not self._readings:
+            return None
+        return round(self._sum / len(self._readings), 2)
 
 
 class LuftdatenSensor(Entity):
@@ -162,14 +818,150 @@ class LuftdatenSensor(Entity):
         """Return the unit of measurement of this entity, if any."""
         return self._var_units
 
-    def update(self):
+    async def async_update(self):
         """Get the latest data for the states."""
-        self._api.update()
+        await self._api.async_update()
 
         self._state = self._api.data.get(self.sensor, None)
 
         self._attributes[ATTR_SENSOR_ID] = self._api.sensor_id
 
+        # Stale readings are kept, the age tells how old they are
+        if self._api.timestamp is not None:
+            self._attributes[ATTR_AGE] = round(
+                (dt_util.utcnow() - self._api.timestamp).total_seconds())
+
+    @property
+    def device_state_attributes(self):
+        """Return the state attributes."""
+        return self._attributes
+
+
+def aggregate(values, distances, ages, method=AGGREGATE_MEDIAN, radius=None):
+    """Combine the readings of several stations in one vectorized pass.
+
+    Returns the aggregated value and the masks of the used and outlier
+    readings. Stations are weighted by distance (km) relative to the radius
+    and by age (seconds). Stations of which the distance is unknown (NaN)
+    weigh as much as the farthest.
+    """
+    values = np.asarray(values, dtype=float)
+    distances = np.asarray(distances, dtype=float)
+    ages = np.asarray(ages, dtype=float)
+
+    known = np.isfinite(distances)
+    scale = radius if radius else (distances[known].max() if known.any() else 0.0)
+    scale = max(scale, MIN_DISTANCE_SCALE)
+    distances = np.where(known, distances, scale)
+
+    valid = np.isfinite(values) & (ages <= FRESHNESS_MAX_AGE)
+    weights = np.where(
+        valid,
+        np.exp2(-distances / scale - np.maximum(ages, 0) / FRESHNESS_SCALE),
+        0.0)
+
+    if not valid.any():
+        return None, valid, np.zeros_like(valid)
+
+    # Outliers by the median absolute deviation
+    median = np.median(values[valid])
+    deviation = np.abs(values - median)
+    mad = MAD_SCALE * np.median(deviation[valid])
+    if mad > 0:
+        outliers = valid & (deviation > OUTLIER_THRESHOLD * mad)
+    else:
+        outliers = np.zeros_like(valid)
+
+    used = valid & ~outliers
+    order = np.argsort(np.where(used, values, np.inf))[:np.count_nonzero(used)]
+    sorted_values = values[order]
+    sorted_weights = weights[order]
+    if sorted_weights.sum() <= 0:
+        # All weights underflowed, count the stations equally
+        sorted_weights = np.ones_like(sorted_weights)
+    cumulative = np.cumsum(sorted_weights)
+    total = cumulative[-1]
+
+    if method == AGGREGATE_TRIMMED_MEAN:
+        # Drop the lowest and highest fraction of the weight
+        lower = cumulative - sorted_weights
+        keep = (cumulative > TRIM_FRACTION * total) & (lower < (1 - TRIM_FRACTION) * total)
+        value = np.average(sorted_values[keep], weights=sorted_weights[keep])
+    else:
+        # Weighted median
+        value = sorted_values[np.searchsorted(cumulative, total / 2.0)]
+
+    return float(value), used, outliers
+
+
+class LuftdatenAggregateSensor(Entity):
+    """Implementation of a virtual sensor combining several stations."""
+
+    def __init__(self, apis, sensor, method, name, latitude, longitude, radius=None):
+        """Initialize the virtual Luftdaten sensor."""
+        self._apis = apis
+        self.sensor = sensor
+        self._method = method
+        self._name = name
+        self._latitude = latitude
+        self._longitude = longitude
+        self._radius = radius
+        self._var_name = SENSOR_TYPES[sensor][0]
+        self._var_units = SENSOR_TYPES[sensor][1]
+        self._var_icon = SENSOR_TYPES[sensor][2]
+
+        self._state = None
+        self._attributes = {}
+        self._attributes[ATTR_ATTRIBUTION] = CONF_ATTRIBUTION
+
+    @property
+    def name(self):
+        """Return the name of the sensor, if any."""
+        return "{} {}".format(self._name, self._var_name)
+
+    @property
+    def icon(self):
+        """Icon to use in the frontend, if any."""
+        return self._var_icon
+
+    @property
+    def state(self):
+        """Return the state of the sensor."""
+        return self._state
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement of this entity, if any."""
+        return self._var_units
+
+    async def async_update(self):
+        """Get the latest data for the states."""
+        now = dt_util.utcnow()
+        values = []
+        distances = []
+        ages = []
+        for api in self._apis:
+            value = api.data.get(self.sensor)
+            values.append(value if value is not None else float('nan'))
+            if api.latitude is not None:
+                distances.append(location.distance(
+                    self._latitude, self._longitude, api.latitude, api.longitude) / 1000)
+            else:
+                distances.append(float('nan'))
+            if api.timestamp is not None:
+                ages.append((now - api.timestamp).total_seconds())
+            else:
+                ages.append(float('inf'))
+
+        value, used, outliers = aggregate(
+            values, distances, ages, self._method, self._radius)
+
+        self._state = round(value, 2) if value is not None else None
+        self._attributes[ATTR_STATIONS] = [
+            api.sensor_id for api, mask in zip(self._apis, used) if mask]
+        self._attributes[ATTR_OUTLIERS] = [
+            api.sensor_id for api, mask in zip(self._apis, outliers) if mask]
+
     @property
     def device_state_attributes(self):
         """Return the state attributes."""
@@ -0,0 +1,76 @@
+"""Benchmark of the Eetlijst status page parsers on the recorded pages.
+
+Reports the parse time, the peak traced memory while parsing a page and
+the number of memory blocks that are still allocated for the parsed rows.
+
+Run with python tests/bench_eetlijst.py [repeat].
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest  # noqa: E402,F401 pylint: disable=unused-import,wrong-import-position
+from test_eetlijst import PAGES, parse  # noqa: E402 pylint: disable=wrong-import-position
+
+from custom_components.sensor import eetlijst  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class SoupApi(eetlijst.EetlijstApi):
+    """Always parse the page with the BeautifulSoup document tree."""
+
+    def _page_rows(self, content):
+        page = self._parse_soup(content)
+        self.residents = page.residents
+        self.accountname = page.accountname
+        return iter(page.rows)
+
+
+def allocations(function):
+    """Return the peak size (bytes) and number of blocks kept by the result of function."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = function()  # noqa: F841 pylint: disable=unused-variable
+        peak = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename')
+                 if stat.count_diff > 0)
+    return peak, blocks
+
+
+def main(repeat=200):
+    fast_api = eetlijst.EetlijstApi(None, None, transport=mock.Mock())
+    soup_api = SoupApi(None, None, transport=mock.Mock())
+
+    print("{:<24} {:>8} {:>10} {:>10} {:>8} {:>10} {:>10} {:>12} {:>12}".format(
+        "page", "bytes", "fast (ms)", "soup (ms)", "speedup",
+        "fast (KiB)", "soup (KiB)", "fast blocks", "soup blocks"))
+    for path in PAGES:
+        with open(path, encoding='utf-8') as page:
+            content = page.read()
+
+        if parse(content) != parse(content, soup=True):
+            raise AssertionError("Parsers differ on {}".format(path))
+
+        fast = min(timeit.repeat(
+            lambda: list(fast_api._parse_statuses(content)), number=1, repeat=repeat))
+        soup = min(timeit.repeat(
+            lambda: list(soup_api._parse_statuses(content)), number=1, repeat=repeat))
+        fast_peak, fast_blocks = allocations(lambda: list(fast_api._parse_statuses(content)))
+        soup_peak, soup_blocks = allocations(lambda: list(soup_api._parse_statuses(content)))
+
+        print("{:<24} {:>8} {:>10.3f} {:>10.3f} {:>7.1f}x {:>10.1f} {:>10.1f} {:>12} {:>12}".format(
+            os.path.basename(path), len(content.encode('utf-8')),
+            fast * 1000, soup * 1000, soup / fast,
+            fast_peak / 1024, soup_peak / 1024, fast_blocks, soup_blocks))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,194 @@
+"""Benchmark of the import and setup time of the components.
+
+Each component is imported in a fresh interpreter in which Home Assistant
+itself is already imported, such that only the component and the libraries
+it imports at module load are measured. The libraries that are deferred to
+their first use should not show up as loaded.
+
+The setups are measured after the component is imported and run without
+network access: Docker is replaced by a mock client, Eetlijst logs in to
+the local stand-in server and Luftdaten starts from stations without
+readings.
+
+Run with python tests/bench_startup.py [repeat].
+"""
+import asyncio
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TESTS)
+import conftest  # noqa: E402,F401 pylint: disable=unused-import,wrong-import-position
+
+COMPONENTS = [
+    'custom_components.http_fetch',
+    'custom_components.component_profiler',
+    'custom_components.docker_monitor',
+    'custom_components.docker_monitor.sensor',
+    'custom_components.docker_monitor.switch',
+    'custom_components.sensor.eetlijst',
+    'custom_components.sensor.luftdaten_cu',
+]
+
+# Libraries that the components only import when they are used
+DEFERRED = ['bs4', 'dateutil', 'docker', 'numpy', 'requests']
+
+IMPORT_SCRIPT = """
+import importlib, json, sys, time
+sys.path.insert(0, {tests!r})
+import conftest
+import homeassistant.core
+import homeassistant.helpers.config_validation
+import homeassistant.helpers.entity
+import homeassistant.components.sensor
+import homeassistant.components.switch
+preloaded = set(sys.modules)
+start = time.perf_counter()
+importlib.import_module({name!r})
+elapsed = time.perf_counter() - start
+loaded = [name for name in {deferred!r} if name in sys.modules and name not in preloaded]
+print(json.dumps([elapsed, loaded]))
+"""
+
+
+def import_time(name, repeat):
+    """Return the shortest import time of a component and the deferred libraries it loaded.
+
+    None is returned if the component cannot be imported with the installed
+    Home Assistant version.
+    """
+    results = []
+    for _ in range(repeat):
+        try:
+            output = subprocess.check_output([
+                sys.executable, '-c',
+                IMPORT_SCRIPT.format(tests=TESTS, name=name, deferred=DEFERRED)],
+                stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            return None
+        results.append(json.loads(output))
+    return min(results, key=lambda result: result[0])
+
+
+def create_hass(config_dir):
+    hass = mock.MagicMock()
+    hass.data = {}
+    hass.config.path.side_effect = lambda *path: os.path.join(config_dir, *path)
+    return hass
+
+
+def timed(setup, *args):
+    """Return the seconds setup took, or None if it failed."""
+    start = time.perf_counter()
+    result = setup(*args)
+    elapsed = time.perf_counter() - start
+    return elapsed if result is not False else None
+
+
+def setup_component_profiler(hass):
+    from custom_components import component_profiler
+    config = component_profiler.CONFIG_SCHEMA({component_profiler.DOMAIN: {}})
+    return timed(component_profiler.setup, hass, config)
+
+
+def setup_docker_monitor(hass):
+    import docker
+    from custom_components import docker_monitor
+    config = docker_monitor.CONFIG_SCHEMA({docker_monitor.DOMAIN: {
+        docker_monitor.CONF_CONTAINERS: ['web'],
+    }})
+    with mock.patch.object(docker, 'DockerClient'):
+        return timed(docker_monitor.setup, hass, config)
+
+
+def setup_eetlijst(hass):
+    import http.server
+    from custom_components.sensor import eetlijst
+    from test_eetlijst import load_page
+    from test_eetlijst_session import PASSWORD, USERNAME, StandInHandler
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.requests = []
+    server.session_id = None
+    server.session_number = 0
+    server.page = load_page('main_deadline.html')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    base_url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    config = {
+        eetlijst.CONF_USERNAME: USERNAME,
+        eetlijst.CONF_PASSWORD: PASSWORD,
+    }
+    entities = []
+    try:
+        with mock.patch.object(eetlijst, 'BASE_URL', base_url), \
+                mock.patch.object(eetlijst, 'call_later'):
+            elapsed = timed(eetlijst.setup_platform, hass, config, entities.extend)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return elapsed if entities else None
+
+
+def setup_luftdaten(hass):
+    from custom_components.http_fetch import DATA_HTTP_FETCH
+    from custom_components.sensor import luftdaten_cu
+
+    hass.data[DATA_HTTP_FETCH] = mock.Mock()
+    config = luftdaten_cu.PLATFORM_SCHEMA({
+        'platform': 'luftdaten_cu',
+        luftdaten_cu.CONF_SENSORID: 1234,
+        luftdaten_cu.CONF_MONITORED_CONDITIONS: [luftdaten_cu.SENSOR_PM10],
+    })
+    entities = []
+
+    async def setup():
+        return await luftdaten_cu.async_setup_platform(
+            hass, config, lambda sensors, update: entities.extend(sensors))
+
+    store = mock.Mock(async_load=mock.AsyncMock(return_value=None))
+    with mock.patch.object(luftdaten_cu, 'Store', return_value=store), \
+            mock.patch.object(luftdaten_cu, 'async_call_later'):
+        return timed(asyncio.run, setup())
+
+
+SETUPS = [
+    ('component_profiler', setup_component_profiler),
+    ('docker_monitor', setup_docker_monitor),
+    ('sensor.eetlijst', setup_eetlijst),
+    ('sensor.luftdaten_cu', setup_luftdaten),
+]
+
+
+def main(repeat=5):
+    print("{:<40} {:>12}  {}".format("component", "import (ms)", "deferred libraries loaded"))
+    for name in COMPONENTS:
+        result = import_time(name, repeat)
+        if result is None:
+            print("{:<40} {:>12}".format(name, "(failed)"))
+            continue
+        elapsed, loaded = result
+        print("{:<40} {:>12.1f}  {}".format(name, elapsed * 1000, ', '.join(loaded) or '-'))
+
+    print()
+    print("{:<40} {:>12}".format("component", "setup (ms)"))
+    with tempfile.TemporaryDirectory() as config_dir:
+        for name, setup in SETUPS:
+            # Only the setup is measured, the module itself is imported above
+            importlib.import_module('custom_components.' + name)
+            elapsed = setup(create_hass(config_dir))
+            if elapsed is None:
+                print("{:<40} {:>12}".format(name, "(failed)"))
+            else:
+                print("{:<40} {:>12.1f}".format(name, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
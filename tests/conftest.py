@@ -0,0 +1,11 @@
+"""Make the repository importable as custom_components, like in a configuration directory."""
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'custom_components' not in sys.modules:
+    custom_components = types.ModuleType('custom_components')
+    custom_components.__path__ = [ROOT]
+    sys.modules['custom_components'] = custom_components
@@ -0,0 +1,19 @@
+"""Tests of the Docker monitor configuration."""
+import pytest
+import voluptuous as vol
+
+from custom_components import docker_monitor
+
+
+def test_log_error_pattern_is_compiled():
+    config = docker_monitor.CONFIG_SCHEMA({docker_monitor.DOMAIN: {}})
+    pattern = config[docker_monitor.DOMAIN][docker_monitor.CONF_LOG_ERROR_PATTERN]
+    assert pattern.search(b'2019-02-19 ERROR: disk full')
+    assert not pattern.search(b'2019-02-19 INFO: started')
+
+
+def test_invalid_log_error_pattern():
+    with pytest.raises(vol.Invalid):
+        docker_monitor.CONFIG_SCHEMA({docker_monitor.DOMAIN: {
+            docker_monitor.CONF_LOG_ERROR_PATTERN: '(error',
+        }})
@@ -0,0 +1,90 @@
+"""Tests of the Eetlijst status page parsers against the recorded pages."""
+import glob
+import os
+from unittest import mock
+
+import pytest
+
+from custom_components.sensor import eetlijst
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'eetlijst')
+PAGES = sorted(glob.glob(os.path.join(FIXTURES, 'main_*.html')))
+
+RESIDENTS = ['Resident 1', 'Resident 2', 'Resident 3', 'Resident 4', 'Resident é']
+
+
+def load_page(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as page:
+        return page.read()
+
+
+def parse(content, soup=False):
+    """Return the list name, residents and status rows of the page."""
+    api = eetlijst.EetlijstApi(None, None, transport=mock.Mock())
+    with mock.patch.object(api, '_main_page', return_value=content):
+        if soup:
+            with mock.patch.object(eetlijst._StatusPageParser, 'iter_rows',
+                                   side_effect=eetlijst.ScrapingError("Disabled")):
+                rows = api.get_statuses()
+        else:
+            rows = api.get_statuses()
+    return api.accountname, api.residents, [vars(row) for row in rows]
+
+
+@pytest.mark.parametrize('path', PAGES, ids=os.path.basename)
+def test_parsers_are_equivalent(path):
+    pytest.importorskip('bs4')
+    with open(path, encoding='utf-8') as page:
+        content = page.read()
+
+    accountname, residents, rows = parse(content)
+    assert accountname == "Huis & Haard"
+    assert residents == RESIDENTS
+    assert len(rows) == 7
+
+    assert (accountname, residents, rows) == parse(content, soup=True)
+
+
+def test_deadline():
+    _, _, rows = parse(load_page('main_deadline.html'))
+    assert all(row['deadline'] == row['timestamp'] for row in rows)
+    assert rows[0]['statuses'] == {
+        'Resident 1': 0, 'Resident 2': 1, 'Resident 3': -1, 'Resident 4': 2, 'Resident é': -2}
+
+
+def test_no_deadline():
+    _, _, rows = parse(load_page('main_no_deadline.html'))
+    assert all(row['deadline'] is None for row in rows)
+    assert rows[0]['timestamp'].timestamp() == 1549926000
+
+
+def test_extra_count():
+    _, _, rows = parse(load_page('main_extra_count.html'))
+    statuses = [status for row in rows for status in row['statuses'].values()]
+    assert -28 in statuses
+
+
+def test_leeg():
+    _, _, rows = parse(load_page('main_leeg.html'))
+    statuses = [status for row in rows for status in row['statuses'].values()]
+    assert None in statuses
+
+
+def test_changed_layout():
+    pytest.importorskip('bs4')
+    content = load_page('main_deadline.html').replace('width="80"', '')
+    with pytest.raises(eetlijst.ScrapingError):
+        parse(content)
+
+
+def test_unchanged_page_is_not_parsed_again():
+    content = load_page('main_deadline.html')
+    api = eetlijst.EetlijstApi(None, None, transport=mock.Mock())
+
+    with mock.patch.object(api, '_main_page', return_value=content):
+        first = api.get_statuses()
+        with mock.patch.object(api, '_page_rows', side_effect=AssertionError):
+            second = api.get_statuses()
+
+    assert second == first
+    assert (api.parse_hits, api.parse_misses) == (1, 1)
@@ -0,0 +1,157 @@
+"""Tests of the Eetlijst session flow against a local stand-in server."""
+import http.server
+import threading
+import urllib.parse
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+import requests
+
+from custom_components.sensor import eetlijst
+
+from test_eetlijst import load_page
+
+USERNAME = 'huis'
+PASSWORD = 'geheim'
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serve login.php and main.php like Eetlijst does."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        server = self.server
+        server.requests.append((url.path, query))
+
+        if url.path == '/login.php' and 'login' in query:
+            if (query['login'], query.get('pass')) != (USERNAME, PASSWORD):
+                return self._redirect('/login.php?r=failed')
+            server.session_number += 1
+            server.session_id = 'session{}'.format(server.session_number)
+            return self._redirect('/main.php?session_id=' + server.session_id)
+
+        if url.path == '/login.php':
+            return self._send('<html><body><form action="login.php"></form></body></html>')
+
+        if url.path == '/main.php':
+            if server.session_id is None or query.get('session_id') != server.session_id:
+                return self._redirect('/login.php')
+            return self._send(server.page)
+
+        self.send_error(404)
+
+    def _redirect(self, location):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send(self, content):
+        body = content.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.requests = []
+    server.session_id = None
+    server.session_number = 0
+    server.page = load_page('main_deadline.html')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    with mock.patch.object(eetlijst, 'BASE_URL', base_url):
+        yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def transport():
+    with requests.Session() as session:
+        yield session
+
+
+def paths(server):
+    return [path for path, query in server.requests]
+
+
+def test_login_caches_main_page(server, transport):
+    api = eetlijst.EetlijstApi(USERNAME, PASSWORD, transport=transport)
+    api.update()
+
+    assert api.session[0] == 'session1'
+    assert api.accountname == "Huis & Haard"
+    assert len(api.statuses) == 7
+    # The main page the login redirected to is used
+    assert paths(server) == ['/login.php', '/main.php']
+
+    # The main page is cached
+    api.update()
+    assert len(server.requests) == 2
+
+
+def test_refreshes_reuse_session(server, transport):
+    api = eetlijst.EetlijstApi(USERNAME, PASSWORD, transport=transport)
+    now = api._now()
+    with mock.patch.object(api, '_now', return_value=now):
+        api.update()
+
+    # The next refreshes, after the cached page expired and a bit later than
+    # the interval
+    for refresh in range(1, 3):
+        api.cache.clear()
+        later = now + (eetlijst.REFRESH_INTERVAL + timedelta(seconds=10)) * refresh
+        with mock.patch.object(api, '_now', return_value=later):
+            api.update()
+
+    assert paths(server).count('/login.php') == 1
+    assert api.session[0] == 'session1'
+
+
+def test_wrong_password(server, transport):
+    api = eetlijst.EetlijstApi(USERNAME, 'fout', transport=transport)
+    with pytest.raises(eetlijst.LoginError):
+        api.update()
+
+
+def test_expired_session_logs_in_again(server, transport):
+    api = eetlijst.EetlijstApi(USERNAME, PASSWORD, transport=transport)
+    api.update()
+
+    server.session_id = None
+    api.cache.clear()
+    api.update()
+
+    assert api.session[0] == 'session2'
+    # Redirected to the login page, logged in again and retried
+    assert paths(server)[2:] == [
+        '/main.php', '/login.php', '/login.php', '/main.php']
+
+
+def test_set_status_submits_change(server, transport):
+    api = eetlijst.EetlijstApi(USERNAME, PASSWORD, transport=transport)
+    api.update()
+    api.set_status('Resident 1', 1)
+
+    path, query = server.requests[-1]
+    assert path == '/main.php'
+    assert query == {
+        'session_id': 'session1',
+        'day': str(int(api.statuses[0].timestamp.timestamp())),
+        'who': '0',
+        'what': '1',
+    }
+    assert api.states['Resident 1'][0] == "Cook"
@@ -0,0 +1,102 @@
+"""Tests of the shared HTTP fetch layer."""
+import asyncio
+import http.server
+import threading
+import urllib.parse
+from unittest import mock
+
+import pytest
+
+from custom_components import http_fetch
+
+
+class CookieHandler(http.server.BaseHTTPRequestHandler):
+    """Set a cookie on /login and echo it and the headers on /echo."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url = urllib.parse.urlsplit(self.path)
+        self.send_response(200)
+        if url.path == '/login':
+            self.send_header('Set-Cookie', 'user={}; Path=/'.format(url.query))
+        body = '{} {}'.format(
+            self.headers.get('Cookie'), self.headers.get('Accept-Language')).encode()
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@pytest.fixture
+def base_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), CookieHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetchers_keep_cookies_apart(base_url):
+    alice = http_fetch.get_fetcher()
+    bob = http_fetch.get_fetcher()
+
+    alice.get(base_url + 'login?alice')
+    bob.get(base_url + 'login?bob')
+
+    assert alice.get(base_url + 'echo').text == 'user=alice None'
+    assert bob.get(base_url + 'echo').text == 'user=bob None'
+
+
+def test_fetchers_share_rate_limits():
+    alice = http_fetch.get_fetcher()
+    bob = http_fetch.get_fetcher()
+    assert alice._get_host('example.com')[1] is bob._get_host('example.com')[1]
+    assert alice._get_host('example.com')[0] is not bob._get_host('example.com')[0]
+
+
+def test_cache_key_includes_headers(base_url):
+    fetcher = http_fetch.Fetcher()
+    english = fetcher.get(base_url + 'echo', ttl=60, headers={'Accept-Language': 'en'})
+    dutch = fetcher.get(base_url + 'echo', ttl=60, headers={'Accept-Language': 'nl'})
+    again = fetcher.get(base_url + 'echo', ttl=60, headers={'Accept-Language': 'nl'})
+
+    assert english.text == 'None en'
+    assert dutch.text == 'None nl'
+    assert again is dutch
+
+    fetcher.invalidate(base_url + 'echo', headers={'Accept-Language': 'nl'})
+    assert fetcher.get(base_url + 'echo', ttl=60, headers={'Accept-Language': 'nl'}) is not dutch
+
+
+def test_async_cache_key_includes_arguments():
+    responses = []
+
+    class Response:
+        def __init__(self, kwargs):
+            self.kwargs = kwargs
+
+        def raise_for_status(self):
+            pass
+
+        async def json(self, content_type=None):
+            return self.kwargs['headers']['Accept-Language']
+
+        def release(self):
+            pass
+
+    async def request(method, url, **kwargs):
+        responses.append(kwargs)
+        return Response(kwargs)
+
+    async def main():
+        fetcher = http_fetch.AsyncFetcher(mock.Mock(request=request))
+        url = 'http://device/data.json'
+        english, dutch = await asyncio.gather(
+            fetcher.async_get_json(url, ttl=60, headers={'Accept-Language': 'en'}),
+            fetcher.async_get_json(url, ttl=60, headers={'Accept-Language': 'nl'}))
+        again = await fetcher.async_get_json(url, ttl=60, headers={'Accept-Language': 'nl'})
+        return english, dutch, again
+
+    assert asyncio.run(main()) == ('en', 'nl', 'nl')
+    assert len(responses) == 2
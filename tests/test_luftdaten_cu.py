@@ -0,0 +1,329 @@
+"""Tests of the Luftdaten registry against a local stub of the API."""
+import asyncio
+import os
+import tempfile
+from unittest import mock
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from homeassistant.exceptions import PlatformNotReady
+from homeassistant.util.json import save_json
+
+from custom_components.http_fetch import AsyncFetcher
+from custom_components.sensor import luftdaten_cu
+
+ETAG = '"5c8a6b3e-1f2"'
+MEASUREMENTS = [{
+    'timestamp': '2019-03-14 12:00:00',
+    'location': {'latitude': '52.1', 'longitude': '5.1'},
+    'sensor': {'id': 1234},
+    'sensordatavalues': [
+        {'value_type': 'P1', 'value': '12.5'},
+        {'value_type': 'P2', 'value': '7.5'},
+    ],
+}]
+
+
+class StubApi:
+    """Sensor endpoint that answers If-None-Match, optionally slowly."""
+
+    def __init__(self, delay=0, unavailable=False):
+        self.delay = delay
+        self.unavailable = unavailable
+        self.requests = []
+
+    async def sensor(self, request):
+        self.requests.append(dict(request.headers))
+        if self.unavailable:
+            raise web.HTTPServiceUnavailable()
+        if request.match_info.get('sensor_id') == '404':
+            raise web.HTTPNotFound()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if request.headers.get('If-None-Match') == ETAG:
+            return web.Response(status=304, headers={'ETag': ETAG})
+        return web.json_response(MEASUREMENTS, headers={'ETag': ETAG})
+
+
+def run(stub, test):
+    """Run test(registry) with the API of the registry served by stub."""
+    async def main(config_dir):
+        app = web.Application()
+        app.router.add_get('/v1/sensor/{sensor_id}/', stub.sensor)
+        app.router.add_get('/static/v1/data.json', stub.sensor)
+        async with TestServer(app) as server:
+            async with aiohttp.ClientSession() as session:
+                loop = asyncio.get_running_loop()
+                hass = mock.MagicMock()
+                hass.async_add_executor_job.side_effect = \
+                    lambda target, *args: loop.run_in_executor(None, target, *args)
+                hass.async_create_task.side_effect = loop.create_task
+                hass.config.path.side_effect = lambda *path: os.path.join(config_dir, *path)
+                registry = luftdaten_cu.LuftdatenRegistry(hass, AsyncFetcher(session))
+                with mock.patch.object(luftdaten_cu, 'BASE_URL', str(server.make_url('/v1'))), \
+                        mock.patch.object(luftdaten_cu, 'BULK_URL',
+                                          str(server.make_url('/static/v1/data.json'))):
+                    await test(registry)
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        os.mkdir(os.path.join(config_dir, luftdaten_cu.STORAGE_DIR))
+        asyncio.run(main(config_dir))
+
+
+def save_index(registry, age):
+    """Store an index of one station, built age ago."""
+    save_json(registry._hass.config.path(luftdaten_cu.STORAGE_DIR, luftdaten_cu.INDEX_FILE), {
+        'timestamp': luftdaten_cu.dt_util.utcnow().timestamp() - age.total_seconds(),
+        'stations': [[5678, 52.1, 5.1, ['P1']]],
+    })
+
+
+def test_not_modified_is_not_parsed():
+    stub = StubApi()
+
+    async def test(registry):
+        api = luftdaten_cu.LuftdatenApi(registry, 1234)
+        with mock.patch.object(api, 'set_measurements') as set_measurements:
+            await registry._async_get_station(api)
+            set_measurements.assert_called_once_with(MEASUREMENTS)
+
+            url = luftdaten_cu.BASE_URL + '/sensor/1234/'
+            assert registry._validators[url][0] == ETAG
+
+            set_measurements.reset_mock()
+            await registry._async_get_station(api)
+            set_measurements.assert_not_called()
+
+    run(stub, test)
+    assert 'If-None-Match' not in stub.requests[0]
+    assert stub.requests[1]['If-None-Match'] == ETAG
+
+
+def test_unconditional_fetch_keeps_next_refresh_full():
+    stub = StubApi()
+
+    async def test(registry):
+        url = luftdaten_cu.BASE_URL.replace('/v1', '/static/v1/data.json')
+        index_entries = []
+        await registry._async_fetch(url, index_entries.extend, conditional=False)
+        assert index_entries == MEASUREMENTS
+
+        entries = []
+        assert await registry._async_fetch(url, entries.extend) is True
+        assert entries == MEASUREMENTS
+
+    run(stub, test)
+    assert 'If-None-Match' not in stub.requests[1]
+
+
+def test_timeout():
+    stub = StubApi(delay=1)
+
+    async def test(registry):
+        url = luftdaten_cu.BASE_URL + '/sensor/1234/'
+        with mock.patch.object(luftdaten_cu, 'TIMEOUT', 0.1):
+            with pytest.raises(asyncio.TimeoutError):
+                await registry._async_fetch(url)
+        assert registry._validators == {}
+
+    run(stub, test)
+
+
+def test_refresh_backs_off_after_timeout():
+    stub = StubApi(delay=1)
+
+    async def test(registry):
+        registry._stations[1234] = luftdaten_cu.LuftdatenApi(registry, 1234)
+        delays = []
+        with mock.patch.object(luftdaten_cu, 'TIMEOUT', 0.1), \
+                mock.patch.object(registry, '_schedule_refresh', delays.append):
+            await registry._async_refresh()
+
+        assert registry._failures == 1
+        assert len(delays) == 1
+        assert 0 <= delays[0] <= luftdaten_cu.BACKOFF_BASE * 2
+
+    run(stub, test)
+
+
+def test_refresh_continues_after_failed_station():
+    stub = StubApi()
+
+    async def test(registry):
+        registry._readings = {}
+        registry._store = mock.MagicMock(async_save=mock.AsyncMock())
+        for sensor_id in (404, 1234):
+            registry._stations[sensor_id] = luftdaten_cu.LuftdatenApi(registry, sensor_id)
+        delays = []
+        with mock.patch.object(registry, '_schedule_refresh', delays.append):
+            await registry._async_refresh()
+
+        assert registry._stations[1234].data['P1'] == 12.5
+        assert registry._failures == 0
+        assert delays == [luftdaten_cu.MIN_TIME_BETWEEN_UPDATES.total_seconds()]
+        assert list(registry._readings) == ['1234']
+
+    run(stub, test)
+
+
+def test_refresh_reschedules_after_unexpected_error():
+    stub = StubApi()
+
+    async def test(registry):
+        registry._readings = {}
+        registry._store = mock.MagicMock(async_save=mock.AsyncMock(side_effect=OSError))
+        registry._stations[1234] = luftdaten_cu.LuftdatenApi(registry, 1234)
+        delays = []
+        with mock.patch.object(registry, '_schedule_refresh', delays.append):
+            with pytest.raises(OSError):
+                await registry._async_refresh()
+
+        assert len(delays) == 1
+
+    run(stub, test)
+
+
+def test_malformed_station_does_not_stop_refresh():
+    stub = StubApi()
+
+    async def test(registry):
+        registry._readings = {}
+        registry._store = mock.MagicMock(async_save=mock.AsyncMock())
+        api = registry._stations[1234] = luftdaten_cu.LuftdatenApi(registry, 1234)
+        delays = []
+        with mock.patch.object(api, 'set_measurements', side_effect=KeyError('sensordatavalues')), \
+                mock.patch.object(registry, '_schedule_refresh', delays.append):
+            await registry._async_refresh()
+
+        assert delays == [luftdaten_cu.MIN_TIME_BETWEEN_UPDATES.total_seconds()]
+
+    run(stub, test)
+
+
+def test_register_does_not_wait_for_refresh():
+    stub = StubApi(delay=1)
+
+    async def test(registry):
+        registry._readings = {}
+        registry._store = mock.MagicMock(async_save=mock.AsyncMock())
+        registry._stations[1234] = luftdaten_cu.LuftdatenApi(registry, 1234)
+        with mock.patch.object(registry, '_schedule_refresh'):
+            refresh = asyncio.ensure_future(registry._async_refresh())
+            await asyncio.sleep(0.1)
+            api = await asyncio.wait_for(registry.async_register(5678), 0.5)
+            assert not refresh.done()
+            await refresh
+
+        assert api.sensor_id == 5678
+
+    run(stub, test)
+
+
+def test_registration_during_refresh_is_fetched_soon():
+    stub = StubApi(delay=0.5)
+
+    async def test(registry):
+        registry._readings = {}
+        registry._store = mock.MagicMock(async_save=mock.AsyncMock())
+        registry._stations[1234] = luftdaten_cu.LuftdatenApi(registry, 1234)
+        with mock.patch.object(luftdaten_cu, 'async_call_later') as call_later:
+            refresh = asyncio.ensure_future(registry._async_refresh())
+            await asyncio.sleep(0.1)
+            await registry.async_register(5678)
+            await refresh
+
+        delays = [call[0][1] for call in call_later.call_args_list]
+        assert delays == [luftdaten_cu.REGISTER_DELAY]
+        call_later.return_value.assert_not_called()
+
+    run(stub, test)
+
+
+def test_setup_without_index_is_retried():
+    stub = StubApi(unavailable=True)
+
+    async def test(registry):
+        registry._hass.data = {luftdaten_cu.DATA_LUFTDATEN: registry}
+        config = luftdaten_cu.PLATFORM_SCHEMA({
+            'platform': 'luftdaten_cu',
+            luftdaten_cu.CONF_RADIUS: 5,
+            luftdaten_cu.CONF_LATITUDE: 52.1,
+            luftdaten_cu.CONF_LONGITUDE: 5.1,
+            luftdaten_cu.CONF_MONITORED_CONDITIONS: [luftdaten_cu.SENSOR_PM10],
+        })
+        with pytest.raises(PlatformNotReady):
+            await luftdaten_cu.async_setup_platform(registry._hass, config, mock.Mock())
+
+    run(stub, test)
+
+
+def test_expired_index_is_used_when_rebuild_fails():
+    stub = StubApi(unavailable=True)
+
+    async def test(registry):
+        save_index(registry, luftdaten_cu.INDEX_MAX_AGE * 2)
+        index = await registry.async_get_index()
+        assert index.nearest(52.1, 5.1, 5, 'P1', 3) == [5678]
+
+        await registry._index_task
+        assert await registry.async_get_index() is index
+
+    run(stub, test)
+    assert len(stub.requests) == 1
+
+
+def test_expired_index_is_rebuilt_in_background():
+    stub = StubApi()
+
+    async def test(registry):
+        save_index(registry, luftdaten_cu.INDEX_MAX_AGE * 2)
+        index = await registry.async_get_index()
+        assert index.nearest(52.1, 5.1, 5, 'P1', 3) == [5678]
+
+        await registry._index_task
+        rebuilt = await registry.async_get_index()
+        assert not rebuilt.is_expired()
+        assert rebuilt.nearest(52.1, 5.1, 5, 'P1', 3) == [1234]
+
+    run(stub, test)
+
+
+def test_fresh_index_is_not_rebuilt():
+    stub = StubApi()
+
+    async def test(registry):
+        save_index(registry, luftdaten_cu.INDEX_MAX_AGE / 2)
+        index = await registry.async_get_index()
+        assert index.nearest(52.1, 5.1, 5, 'P1', 3) == [5678]
+        assert registry._index_task is None
+
+    run(stub, test)
+    assert stub.requests == []
+
+
+def test_aggregate_is_not_dominated_by_the_nearest_station():
+    value, used, outliers = luftdaten_cu.aggregate(
+        [12, 10, 11, 9, 10.5], [1, 2, 3, 4, 5], [0] * 5, radius=5)
+    assert value == 10.5
+    assert used.all()
+    assert not outliers.any()
+
+
+def test_aggregate_weighs_unknown_location_least():
+    median, _, _ = luftdaten_cu.aggregate(
+        [10, 20, 20], [float('nan'), 4, 5], [0] * 3)
+    assert median == 20
+
+    mean, _, _ = luftdaten_cu.aggregate(
+        [10, 20], [float('nan'), 0.5], [0] * 2, luftdaten_cu.AGGREGATE_TRIMMED_MEAN)
+    assert mean > 15
+
+
+def test_aggregate_with_zero_weights():
+    for method in (luftdaten_cu.AGGREGATE_MEDIAN, luftdaten_cu.AGGREGATE_TRIMMED_MEAN):
+        value, used, _ = luftdaten_cu.aggregate(
+            [10, 11, 12], [1e6] * 3, [0] * 3, method, radius=1e-3)
+        assert 10 <= value <= 12
+        assert used.all()